@@ -15,10 +15,23 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import gettext
+import __builtin__
 import os
 
-gettext.install('melange', unicode=1)
+
+def _install_gettext(message):
+    """Stands in for _ until the first message needs translating.
+
+    Loading the translation catalog is left to that first call so that
+    importing melange_client stays cheap.
+
+    """
+    import gettext
+    gettext.install('melange', unicode=1)
+    return _(message)
+
+
+__builtin__._ = _install_gettext
 
 
 def melange_root_path():
@@ -0,0 +1,129 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Spreads requests across several Melange API endpoints."""
+
+import random
+import threading
+
+from melange_client import breaker
+from melange_client import exception
+
+
+class Endpoint(object):
+
+    def __init__(self, host, port, circuit_breaker):
+        self.host = host
+        self.port = port
+        self.breaker = circuit_breaker
+        self.outstanding = 0
+
+    def __repr__(self):
+        return "%s:%s" % (self.host, self.port)
+
+
+class Balancer(object):
+    """Picks an endpoint for every request.
+
+    With the "power_of_two" policy two endpoints are sampled at random and
+    the one with fewer outstanding requests is used; "least_outstanding"
+    always uses the least busy endpoint.
+
+    Each endpoint has a CircuitBreaker, built with breaker_options, that
+    takes it out of rotation while it keeps failing. Once the breaker lets
+    a trial request through, that endpoint is preferred so it is probed
+    promptly. When every breaker is open, acquire fails fast with
+    CircuitOpenError.
+
+    """
+
+    POLICIES = ("power_of_two", "least_outstanding")
+
+    def __init__(self, endpoints, policy="power_of_two", **breaker_options):
+        if not endpoints:
+            raise ValueError("at least one endpoint is required")
+        if policy not in self.POLICIES:
+            raise ValueError("unknown balancing policy %s" % policy)
+        self.endpoints = [Endpoint(host, port,
+                                   breaker.CircuitBreaker(**breaker_options))
+                          for host, port in endpoints]
+        self.policy = policy
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude=()):
+        """Returns the endpoint to send the next request to.
+
+        Endpoints in exclude are only used when there is no other choice.
+        Every acquired endpoint must be handed back through release, or
+        through cancel when no request was sent to it.
+
+        """
+        with self._lock:
+            endpoint = self._choose(exclude)
+            if endpoint is None:
+                raise exception.CircuitOpenError(
+                    _("Circuit open for every endpoint: %s") %
+                    ", ".join(repr(e) for e in self.endpoints))
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint, success):
+        with self._lock:
+            endpoint.outstanding -= 1
+        if success:
+            endpoint.breaker.record_success()
+        else:
+            endpoint.breaker.record_failure()
+
+    def cancel(self, endpoint):
+        """Hands back an endpoint without recording success or failure."""
+        with self._lock:
+            endpoint.outstanding -= 1
+        endpoint.breaker.cancel_trial()
+
+    def _choose(self, exclude):
+        for endpoint in self.endpoints:
+            if (endpoint not in exclude and endpoint.breaker.trial_due()
+                    and endpoint.breaker.allow_request()):
+                return endpoint
+
+        available = [endpoint for endpoint in self.endpoints
+                     if endpoint.breaker.available()]
+        candidates = ([endpoint for endpoint in available
+                       if endpoint not in exclude] or available)
+        while candidates:
+            endpoint = self._pick(candidates)
+            if endpoint.breaker.allow_request():
+                return endpoint
+            candidates.remove(endpoint)
+        return None
+
+    def _pick(self, candidates):
+        if self.policy == "least_outstanding" or len(candidates) < 3:
+            candidates = list(candidates)
+            random.shuffle(candidates)
+            return min(candidates, key=lambda e: e.outstanding)
+        first, second = random.sample(candidates, 2)
+        return first if first.outstanding <= second.outstanding else second
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for endpoint in self.endpoints:
+                stats[repr(endpoint)] = endpoint.breaker.stats()
+                stats[repr(endpoint)]['outstanding'] = endpoint.outstanding
+            return stats
@@ -0,0 +1,124 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Circuit breaker that stops requests to an endpoint that keeps failing."""
+
+import collections
+import threading
+import time
+
+
+class CircuitBreaker(object):
+    """Tracks the health of one endpoint.
+
+    The breaker opens after failure_threshold failures in a row, or when at
+    least error_rate of the last window requests failed (once min_requests
+    have been seen). While open, requests are refused. After reset_timeout
+    seconds it becomes half-open and lets a single trial request through:
+    success closes it again, failure opens it for another reset_timeout.
+
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    STATES = (CLOSED, OPEN, HALF_OPEN)
+
+    def __init__(self, failure_threshold=5, error_rate=0.5, window=20,
+                 min_requests=10, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.trips = 0
+        self._results = collections.deque(maxlen=window)
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        """Whether allow_request would let a request through right now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return time.time() >= self.opened_at + self.reset_timeout
+            return not self._trial_in_flight
+
+    def trial_due(self):
+        """Whether the next request would be a half-open trial."""
+        with self._lock:
+            return (self.state != self.CLOSED and not self._trial_in_flight
+                    and time.time() >= self.opened_at + self.reset_timeout)
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN and
+                    time.time() >= self.opened_at + self.reset_timeout):
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def cancel_trial(self):
+        """Frees the half-open trial of a request that was never sent."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self._results.append(True)
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self._trial_in_flight = False
+                self._results.clear()
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._results.append(False)
+            if (self.state == self.HALF_OPEN
+                    or self.consecutive_failures >= self.failure_threshold
+                    or self._error_rate() >= self.error_rate):
+                self._open()
+
+    def stats(self):
+        with self._lock:
+            return dict(state=self.state,
+                        consecutive_failures=self.consecutive_failures,
+                        error_rate=self._error_rate(),
+                        trips=self.trips)
+
+    def _error_rate(self):
+        if len(self._results) < self.min_requests:
+            return 0.0
+        failures = len([ok for ok in self._results if not ok])
+        return float(failures) / len(self._results)
+
+    def _open(self):
+        if self.state != self.OPEN:
+            self.trips += 1
+        self.state = self.OPEN
+        self.opened_at = time.time()
+        self._trial_in_flight = False
@@ -0,0 +1,143 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Client-side cache of decoded responses to GET requests."""
+
+import collections
+import threading
+import time
+
+
+class CacheEntry(object):
+
+    def __init__(self, value, expires_at, etag=None, last_modified=None):
+        self.value = value
+        self.expires_at = expires_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def fresh(self):
+        return time.time() < self.expires_at
+
+    def validators(self):
+        """Headers that make a GET for this entry conditional."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    """Bounded LRU cache of decoded GET responses.
+
+    Entries are keyed by a tuple whose first element is the request path,
+    and expire ttl seconds after they were stored. ttls maps resource
+    names to their own TTL; a TTL of 0 leaves that resource uncached. The
+    least recently used entry is evicted once there are max_entries.
+
+    Expired entries are kept, with the ETag and Last-Modified validators
+    of their response, so that they can be revalidated with a conditional
+    GET instead of being downloaded again.
+
+    """
+
+    def __init__(self, max_entries=1000, ttl=60, ttls=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def ttl_for(self, name):
+        return self.ttls.get(name, self.ttl)
+
+    def get(self, key):
+        """Returns the fresh entry stored under key, or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            if not entry.fresh():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def validators(self, key):
+        """Conditional request headers for the entry stored under key."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.validators() if entry else {}
+
+    def refresh(self, name, key):
+        """Restarts the TTL of an entry the server says is unchanged.
+
+        Returns the entry, or None if it has been dropped in the meantime.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.expires_at = time.time() + self.ttl_for(name)
+            # The lookup that led to the revalidation was counted as a miss.
+            self.misses -= 1
+            self.hits += 1
+            self.revalidations += 1
+            return entry
+
+    def put(self, name, key, value, etag=None, last_modified=None):
+        ttl = self.ttl_for(name)
+        if not ttl:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = CacheEntry(value, time.time() + ttl,
+                                            etag, last_modified)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, path):
+        """Drops the entries for path and everything below it."""
+        with self._lock:
+            for key in self._entries.keys():
+                if key[0] == path or key[0].startswith(path + "/"):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            hit_rate = float(self.hits) / lookups if lookups else 0.0
+            return dict(hits=self.hits,
+                        misses=self.misses,
+                        evictions=self.evictions,
+                        revalidations=self.revalidations,
+                        size=len(self._entries),
+                        hit_rate=hit_rate)
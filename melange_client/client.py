@@ -15,65 +15,812 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import errno
+import fcntl
+import hashlib
 import httplib
-import httplib2
 import json
+import os
+import re
+import select
 import socket
+import threading
+import time
 import urllib
 import urlparse
+import zlib
 
+from melange_client import balancer
+from melange_client import compression
 from melange_client import exception
+from melange_client import executor
+from melange_client import timing
+from melange_client import utils
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of keep-alive connections.
+
+    Idle connections are kept per (host, port, use_ssl) key, at most
+    max_size of them per key. A connection is evicted when it has been idle
+    longer than max_idle seconds, has lived longer than max_lifetime seconds,
+    or its socket has been closed by the server.
+
+    """
+
+    def __init__(self, max_size=10, max_idle=30, max_lifetime=300):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.in_use = 0
+        self._idle = {}
+        self._created_at = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, connect):
+        """Returns a (connection, reused) tuple for the given key.
+
+        An idle pooled connection is preferred; connect is called to open a
+        new one when none is usable.
+
+        """
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                connection, released_at = idle.pop()
+                if self._expired(connection, released_at):
+                    self._evict(connection)
+                    continue
+                self.hits += 1
+                self.in_use += 1
+                return connection, True
+        return self.connect(key, connect), False
+
+    def connect(self, key, connect):
+        connection = connect()
+        with self._lock:
+            self.misses += 1
+            self.in_use += 1
+            self._created_at[connection] = time.time()
+        return connection
+
+    def release(self, key, connection):
+        with self._lock:
+            self.in_use -= 1
+            idle = self._idle.setdefault(key, [])
+            if len(idle) >= self.max_size:
+                self._evict(connection)
+            else:
+                idle.append((connection, time.time()))
+
+    def grow(self, max_size):
+        """Raises max_size to at least the given size."""
+        with self._lock:
+            self.max_size = max(self.max_size, max_size)
+
+    def discard(self, connection):
+        with self._lock:
+            self.in_use -= 1
+            self._close(connection)
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for connection, _released_at in idle:
+                    self._close(connection)
+            self._idle.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits,
+                        misses=self.misses,
+                        evictions=self.evictions,
+                        in_use=self.in_use,
+                        idle=sum(len(idle) for idle in self._idle.values()))
+
+    def _expired(self, connection, released_at):
+        now = time.time()
+        created_at = self._created_at.get(connection, now)
+        return (now - released_at > self.max_idle
+                or now - created_at > self.max_lifetime
+                or _is_stale(connection))
+
+    def _evict(self, connection):
+        self.evictions += 1
+        self._close(connection)
+
+    def _close(self, connection):
+        self._created_at.pop(connection, None)
+        connection.close()
+
+
+def _is_stale(connection):
+    """An idle keep-alive socket should have nothing to read.
+
+    If it is readable the server has either closed it or sent something we
+    did not ask for, and it can not be reused.
+
+    """
+    sock = connection.sock
+    if sock is None:
+        return True
+    try:
+        readable, _writable, _errored = select.select([sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return True
+    return bool(readable)
+
+
+def _tenant_id(url):
+    match = re.search(r"/tenants/([^/?]+)", url)
+    return match.group(1) if match else None
+
+
+class TimedHTTPConnection(httplib.HTTPConnection):
+    """HTTPConnection that records how long it took to connect.
+
+    connect_timings holds the seconds spent on DNS resolution and on the TCP
+    connect of the last connect() call.
+
+    """
+
+    connect_timings = None
+
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPConnection.__init__(self, *args, **kwargs)
+        self._create_connection = self._timed_create_connection
+
+    def _timed_create_connection(self, address, timeout,
+                                 source_address=None):
+        started = time.time()
+        addresses = socket.getaddrinfo(address[0], address[1], 0,
+                                       socket.SOCK_STREAM)
+        resolved = time.time()
+        error = socket.error("getaddrinfo returns an empty list")
+        for _family, _type, _proto, _name, sockaddr in addresses:
+            try:
+                sock = socket.create_connection(sockaddr[:2], timeout,
+                                                source_address)
+                break
+            except socket.error as error:
+                pass
+        else:
+            raise error
+        self.connect_timings = dict(dns=resolved - started,
+                                    connect=time.time() - resolved)
+        return sock
+
+
+class TimedHTTPSConnection(httplib.HTTPSConnection, TimedHTTPConnection):
+    """HTTPSConnection that also records the TLS handshake time."""
+
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPSConnection.__init__(self, *args, **kwargs)
+        self._create_connection = self._timed_create_connection
+
+    def connect(self):
+        started = time.time()
+        httplib.HTTPSConnection.connect(self)
+        timings = self.connect_timings
+        timings['tls'] = (time.time() - started - timings['dns'] -
+                          timings['connect'])
+
+
+class Response(object):
+    """A fully read HTTP response.
+
+    The body is read before the connection goes back to the pool, so the
+    response stays usable after the connection has been handed out again.
+
+    """
+
+    timing = None
+    retries = 0
+
+    def __init__(self, response, body, transfer=None, timing=None):
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = dict(response.getheaders())
+        self.timing = timing
+        if transfer:
+            transfer.record_received(len(body))
+        decoder = compression.decoder(self.headers, transfer)
+        self.body = decoder.decode(body) + decoder.flush() if decoder else body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self):
+        return self.body
+
+
+class StreamingResponse(object):
+    """An HTTP response whose body is read from the socket on demand.
+
+    The connection goes back to the pool once the body has been read to the
+    end; closing the response before that closes the connection instead.
+    A compressed body is decoded as it is read.
+
+    """
+
+    timing = None
+    retries = 0
+
+    def __init__(self, response, checkin, transfer=None, timing=None):
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = dict(response.getheaders())
+        self.timing = timing
+        self._response = response
+        self._checkin = checkin
+        self._transfer = transfer
+        self._decoder = compression.decoder(self.headers, transfer)
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self, amt=None):
+        """Reads up to amt bytes off the wire and returns them decoded.
+
+        Only returns an empty string once the body has been read to the end,
+        even if a compressed chunk decodes to nothing.
+
+        """
+        while True:
+            try:
+                started = time.time()
+                data = self._response.read(amt)
+                done = (amt is None or not data or
+                        self._response.isclosed())
+                if self.timing:
+                    self.timing.transfer += time.time() - started
+                    self.timing.bytes_received += len(data)
+                if self._transfer:
+                    self._transfer.record_received(len(data))
+                if self._decoder:
+                    data = self._decoder.decode(data)
+                    if done:
+                        data += self._decoder.flush()
+            except (socket.error, IOError, httplib.HTTPException,
+                    zlib.error) as error:
+                self._release(False)
+                raise exception.ClientConnectionError(
+                    _("Error while communicating with server. "
+                      "Got error: %s") % error)
+            if done:
+                self._release(True)
+            if data or done:
+                return data
+
+    def iter_chunks(self, chunk_size=8192):
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self._release(False)
+
+    def _release(self, complete):
+        if self._checkin is None:
+            return
+        checkin, self._checkin = self._checkin, None
+        checkin(complete and not self._response.will_close)
 
 
 class HTTPClient(object):
 
-    def __init__(self, host='localhost', port=8080, use_ssl=False, timeout=60):
+    # Errors that a reused keep-alive connection raises when the server
+    # closed it while it sat in the pool. Socket errors only count with
+    # one of STALE_SOCKET_ERRNOS; a timeout never does, as the server may
+    # just be hung.
+    STALE_CONNECTION_ERRORS = (httplib.BadStatusLine,
+                               httplib.CannotSendRequest)
+    STALE_SOCKET_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+    # Methods that are safe to send again when a reused connection turns
+    # out to be stale; a request that may have reached the server is not
+    # resent otherwise, as doing it twice could allocate twice.
+    RESENDABLE_METHODS = ("GET", "HEAD", "DELETE")
+
+    # Statuses with which the server says it is getting too many requests.
+    OVERLOAD_STATUSES = (429, 503)
+
+    def __init__(self, host='localhost', port=8080, use_ssl=False, timeout=60,
+                 pool=None, retry_policy=None, endpoints=None,
+                 balancing_policy="power_of_two", breaker_options=None,
+                 hedge_policy=None, rate_limiter=None, concurrency_limit=None,
+                 single_flight=None, response_cache=None,
+                 compress_min_size=None, timing_hooks=None, metrics=None,
+                 tracer=None, slow_log=None):
         self.host = host
         self.port = port
         self.use_ssl = use_ssl
         self.timeout = timeout
+        self.pool = pool or ConnectionPool()
+        self.retry_policy = retry_policy
+        self.balancer = balancer.Balancer(endpoints or [(host, port)],
+                                          policy=balancing_policy,
+                                          **(breaker_options or {}))
+        self.hedge_policy = hedge_policy
+        self.rate_limiter = rate_limiter
+        self.concurrency_limit = concurrency_limit
+        # Shared with the Resources using this transport, to coalesce
+        # identical GETs in flight at the same time, to cache responses, to
+        # collect metrics and traces and to log slow requests.
+        self.single_flight = single_flight
+        self.response_cache = response_cache
+        self.metrics = metrics
+        self.tracer = tracer
+        self.slow_log = slow_log
+        self.compress_min_size = compress_min_size
+        self.transfer = compression.TransferStats()
+        self.timing_hooks = list(timing_hooks or [])
+        self._hedge_executor = None
+        self._lock = threading.Lock()
+
+    def circuit_states(self):
+        """Maps each endpoint to the state of its circuit breaker."""
+        return dict((repr(endpoint), endpoint.breaker.state)
+                    for endpoint in self.balancer.endpoints)
 
-    def _get_connection(self):
+    def add_timing_hook(self, hook):
+        """Calls hook with a timing.RequestTiming after every request."""
+        self.timing_hooks.append(hook)
+
+    def _get_connection(self, host, port):
         if self.use_ssl:
-            return httplib.HTTPSConnection(self.host,
-                                           self.port,
-                                           timeout=self.timeout)
+            return TimedHTTPSConnection(host,
+                                        port,
+                                        timeout=self.timeout)
         else:
-            return httplib.HTTPConnection(self.host,
-                                          self.port,
-                                          timeout=self.timeout)
+            return TimedHTTPConnection(host,
+                                       port,
+                                       timeout=self.timeout)
+
+    def _pool_key(self, endpoint):
+        return (endpoint.host, endpoint.port, self.use_ssl)
+
+    def do_request(self, method, path, body=None, headers=None, params=None,
+                   stream=False):
+        """Sends a request and returns its response.
+
+        With stream the body is left on the socket, to be read from the
+        returned StreamingResponse, and the connection is only returned to
+        the pool once the body has been read. Failed requests are retried
+        as the retry_policy allows.
 
-    def do_request(self, method, path, body=None, headers=None, params=None):
+        Compressed responses are decoded transparently. Request bodies of
+        at least compress_min_size bytes are sent gzipped.
+
+        """
         params = params or {}
-        headers = headers or {}
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', compression.ACCEPT_ENCODING)
+        if (body and self.compress_min_size is not None
+                and len(body) >= self.compress_min_size
+                and 'Content-Encoding' not in headers):
+            body = compression.gzip(body)
+            headers['Content-Encoding'] = "gzip"
 
         url = path + '?' + urllib.urlencode(params)
+        request = (method, url, body, headers, stream)
+
+        if not self.tracer:
+            return self._retrying(*request)
+        with self.tracer.span("http", method=method, url=url) as span:
+            self.tracer.inject(headers)
+            response = self._retrying(*request)
+            span.attributes['status'] = response.status
+            if response.timing:
+                self.tracer.record_timing(response.timing)
+            return response
+
+    def _retrying(self, method, url, body, headers, stream):
+        request = (method, url, body, headers, stream)
+        if self.retry_policy:
+            self.retry_policy.budget.record_request()
+        attempt = 0
+        failed_endpoints = []
+        while True:
+            try:
+                response = self._attempt(*request,
+                                         exclude=failed_endpoints)
+                response.retries = attempt
+                return response
+            except (exception.ClientConnectionError,
+                    exception.MelangeServiceResponseError) as error:
+                error.retries = attempt
+                if not self.retry_policy:
+                    raise
+                delay = self.retry_policy.delay(method, attempt, error)
+                if delay is None:
+                    raise
+                endpoint = getattr(error, 'endpoint', None)
+                if endpoint is not None and endpoint not in failed_endpoints:
+                    failed_endpoints.append(endpoint)
+                attempt += 1
+                if self.metrics:
+                    self.metrics.record_retry(method)
+                time.sleep(delay)
+
+    def _attempt(self, method, url, body, headers, stream, exclude=()):
+        """Sends one attempt, preferring endpoints not in exclude.
+
+        Errors raised for a response or a connection carry the endpoint
+        they came from, so that a retry can go elsewhere.
+
+        """
+        request = (method, url, body, headers, stream)
+        if (self.hedge_policy and method == "GET" and not stream
+                and len(self.balancer.endpoints) > 1):
+            return self._hedged_attempt(*request, exclude=exclude)
+        return self._attempt_on(self.balancer.acquire(exclude=exclude),
+                                *request)
+
+    def _attempt_on(self, endpoint, method, url, body, headers, stream):
+        if self.rate_limiter:
+            self.rate_limiter.acquire(repr(endpoint), _tenant_id(url))
+        if self.concurrency_limit:
+            self.concurrency_limit.acquire()
+        healthy = False
+        overloaded = True
+        started = time.time()
+        try:
+            response = self._exchange(endpoint, method, url, body, headers,
+                                      stream)
+            healthy = response.status < 500
+            overloaded = response.status in self.OVERLOAD_STATUSES
+        except exception.ClientConnectionError as error:
+            error.endpoint = endpoint
+            raise
+        finally:
+            self.balancer.release(endpoint, healthy)
+            if self.concurrency_limit:
+                self.concurrency_limit.release(time.time() - started,
+                                               overloaded)
+        if self.hedge_policy and method == "GET":
+            self.hedge_policy.record_latency(time.time() - started)
+
+        if response.status >= 400:
+            error = exception.MelangeServiceResponseError(response.read(),
+                                                          response.status,
+                                                          response.headers)
+            error.endpoint = endpoint
+            raise error
+        return response
+
+    def _hedged_attempt(self, method, url, body, headers, stream,
+                        exclude=()):
+        """Sends a GET, and a hedge to another endpoint if it is slow.
+
+        The primary request starts on a thread of its own straight away, so
+        it never waits behind other requests and the hedge delay measures
+        only the request; hedges go to a bounded pool. The first successful
+        response wins. A hedge that has not started when the primary
+        completes is cancelled and its endpoint handed back; a request
+        already on the wire is left to finish and its response is dropped,
+        which keeps its connection usable for the pool.
+
+        """
+        request = (method, url, body, headers, stream)
+        primary_endpoint = self.balancer.acquire(exclude=exclude)
+        primary = executor.spawn(self._attempt_on, primary_endpoint, *request)
+        attempts = [(primary, primary_endpoint)]
+        try:
+            primary.exception(timeout=self.hedge_policy.delay())
+        except executor.TimeoutError:
+            if self.hedge_policy.try_hedge():
+                try:
+                    endpoint = self.balancer.acquire(
+                        exclude=list(exclude) + [primary_endpoint])
+                    hedged = self._hedge_pool().submit(self._attempt_on,
+                                                       endpoint, *request)
+                    attempts.append((hedged, endpoint))
+                except exception.CircuitOpenError:
+                    pass
+
+        error = None
+        futures = [future for future, _endpoint in attempts]
+        for future in executor.as_completed(futures):
+            if future.exception() is None:
+                if future is not primary:
+                    self.hedge_policy.record_win()
+                for other, endpoint in attempts:
+                    if other is not future and other.cancel():
+                        self.balancer.cancel(endpoint)
+                return future.result()
+            error = error or future
+        return error.result()
+
+    def _hedge_pool(self):
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = executor.Executor(
+                    max_workers=self.pool.max_size * 2)
+            return self._hedge_executor
+
+    def _exchange(self, endpoint, method, *request):
+        request = (method,) + request
+        key = self._pool_key(endpoint)
+        connect = lambda: self._get_connection(endpoint.host, endpoint.port)
+        try:
+            connection, reused = self.pool.acquire(key, connect)
+            try:
+                return self._send(key, connection, *request)
+            except (socket.error, httplib.HTTPException) as error:
+                if not (reused and self._stale(error)
+                        and self._resendable(method, error)):
+                    raise
+                connection = self.pool.connect(key, connect)
+                return self._send(key, connection, *request)
+        except (socket.error, IOError, httplib.HTTPException,
+                zlib.error) as error:
+            raise exception.ClientConnectionError(
+                _("Error while communicating with %(endpoint)s. "
+                  "Got error: %(error)s") % locals())
+
+    def _stale(self, error):
+        if isinstance(error, socket.timeout):
+            return False
+        if isinstance(error, socket.error):
+            return error.errno in self.STALE_SOCKET_ERRNOS
+        return isinstance(error, self.STALE_CONNECTION_ERRORS)
+
+    def _resendable(self, method, error):
+        return (method in self.RESENDABLE_METHODS
+                or isinstance(error, httplib.CannotSendRequest))
+
+    def _send(self, key, connection, method, url, body, headers,
+              stream=False):
+        request_timing = timing.RequestTiming(method, url,
+                                              "%s:%s" % (key[0], key[1]))
+
+        def checkin(reusable):
+            self._checkin(key, connection, reusable)
+            self._report(request_timing)
 
         try:
-            connection = self._get_connection()
+            started = request_timing.started = time.time()
             connection.request(method, url, body, headers)
+            sent = time.time()
+            connect_timings = getattr(connection, 'connect_timings', None)
+            if connect_timings:
+                connection.connect_timings = None
+                request_timing.record_connect(connect_timings)
+            request_timing.send = max(0, sent - started -
+                                      sum((connect_timings or {}).values()))
+            if body:
+                request_timing.bytes_sent = len(body)
+                self.transfer.record_sent(len(body))
+
             response = connection.getresponse()
-            if response.status >= 400:
-                raise exception.MelangeServiceResponseError(response.read())
-            return response
-        except (socket.error, IOError) as error:
-            raise exception.ClientConnectionError(
-                _("Error while communicating with server. "
-                  "Got error: %s") % error)
+            request_timing.wait = time.time() - sent
+            request_timing.status = response.status
+            if stream and response.status < 400:
+                return StreamingResponse(response, checkin, self.transfer,
+                                         request_timing)
+
+            started = time.time()
+            body = response.read()
+            request_timing.transfer = time.time() - started
+            request_timing.bytes_received = len(body)
+            result = Response(response, body, self.transfer, request_timing)
+        except Exception:
+            self.pool.discard(connection)
+            raise
+        checkin(not response.will_close)
+        return result
+
+    def _report(self, request_timing):
+        for hook in self.timing_hooks:
+            hook(request_timing)
+
+    def _checkin(self, key, connection, reusable):
+        if reusable:
+            self.pool.release(key, connection)
+        else:
+            self.pool.discard(connection)
 
+    def close(self):
+        """Closes pooled connections; the client can still be used after."""
+        with self._lock:
+            hedge_executor, self._hedge_executor = self._hedge_executor, None
+        if hedge_executor:
+            hedge_executor.shutdown(wait=False)
+        self.pool.close()
 
-class AuthorizationClient(httplib2.Http):
 
-    def __init__(self, url, username, access_key, auth_token=None):
-        super(AuthorizationClient, self).__init__()
+class TokenCache(object):
+    """In-memory cache for a keystone token and its expiry time.
+
+    The token is refreshed refresh_margin seconds ahead of its expiry. Only
+    one caller fetches a new token at a time; while it does so the others
+    keep using the old token if it is still valid, or wait for the new one.
+
+    """
+
+    def __init__(self, refresh_margin=60, default_ttl=3600):
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._token = None
+        self._expires_at = 0
+        self._fetching = False
+        self._condition = threading.Condition(threading.Lock())
+
+    def get(self, fetch):
+        """Returns the cached token, calling fetch when it needs refreshing.
+
+        fetch should return a (token, expires_at) tuple, where expires_at is
+        in seconds since the epoch or None when keystone gave no expiry.
+
+        """
+        with self._condition:
+            while True:
+                now = time.time()
+                refresh_at = self._expires_at - self.refresh_margin
+                if self._token and now < refresh_at:
+                    self.hits += 1
+                    return self._token
+                if not self._fetching:
+                    self._fetching = True
+                    self.misses += 1
+                    break
+                if self._token and now < self._expires_at:
+                    self.hits += 1
+                    return self._token
+                self._condition.wait()
+
+        try:
+            token, expires_at = fetch()
+        except Exception:
+            with self._condition:
+                self._fetching = False
+                self._condition.notify_all()
+            raise
+
+        with self._condition:
+            self._store(token, expires_at)
+            self._fetching = False
+            self._condition.notify_all()
+        return token
+
+    def invalidate(self):
+        with self._condition:
+            self._token = None
+            self._expires_at = 0
+
+    def stats(self):
+        with self._condition:
+            lookups = self.hits + self.misses
+            hit_rate = float(self.hits) / lookups if lookups else 0.0
+            return dict(hits=self.hits, misses=self.misses, hit_rate=hit_rate)
+
+    def _store(self, token, expires_at):
+        self._token = token
+        self._expires_at = expires_at or time.time() + self.default_ttl
+
+
+class FileTokenCache(TokenCache):
+    """Token cache that is shared between processes through a file.
+
+    Tokens are stored per (auth_url, username, tenant_id) in a file readable
+    only by the current user. The file is locked while it is read or
+    written, so concurrent processes fetch at most one token between them.
+
+    """
+
+    DEFAULT_DIRECTORY = "~/.melange/tokens"
+
+    def __init__(self, auth_url, username, tenant_id=None, directory=None,
+                 refresh_margin=60, default_ttl=3600):
+        super(FileTokenCache, self).__init__(refresh_margin, default_ttl)
+        self.directory = os.path.expanduser(directory or
+                                            self.DEFAULT_DIRECTORY)
+        key = "\0".join(str(part) for part in (auth_url, username, tenant_id))
+        self.path = os.path.join(self.directory,
+                                 hashlib.sha1(key).hexdigest())
+        self.disk_hits = 0
+
+    def get(self, fetch):
+        return super(FileTokenCache, self).get(
+            lambda: self._load_or_fetch(fetch))
+
+    def invalidate(self):
+        super(FileTokenCache, self).invalidate()
+        try:
+            os.unlink(self.path)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+
+    def stats(self):
+        stats = super(FileTokenCache, self).stats()
+        stats['disk_hits'] = self.disk_hits
+        return stats
+
+    def _load_or_fetch(self, fetch):
+        try:
+            cache_file = self._open()
+        except (IOError, OSError):
+            return fetch()
+
+        try:
+            fcntl.flock(cache_file, fcntl.LOCK_EX)
+            cached = self._read(cache_file)
+            if (cached and time.time() < cached['expires_at'] -
+                    self.refresh_margin):
+                self.disk_hits += 1
+                return cached['token'], cached['expires_at']
+
+            token, expires_at = fetch()
+            expires_at = expires_at or time.time() + self.default_ttl
+            cache_file.seek(0)
+            cache_file.truncate()
+            json.dump(dict(token=token, expires_at=expires_at), cache_file)
+            cache_file.flush()
+            return token, expires_at
+        finally:
+            cache_file.close()
+
+    def _open(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0700)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+        os.fchmod(fd, 0600)
+        return os.fdopen(fd, "r+")
+
+    def _read(self, cache_file):
+        try:
+            cached = json.load(cache_file)
+            return dict(token=cached['token'],
+                        expires_at=float(cached['expires_at']))
+        except (ValueError, KeyError, TypeError):
+            return None
+
+
+class AuthorizationClient(object):
+    """Gets keystone tokens for the Melange API.
+
+    httplib2 is only imported once a token has to be fetched, so clients
+    given an auth token, or none at all, never load it.
+
+    """
+
+    def __init__(self, url, username, access_key, auth_token=None,
+                 token_cache=None):
         self.url = urlparse.urljoin(url, "/v2.0/tokens")
         self.username = username
         self.access_key = access_key
         self.auth_token = auth_token
+        self.token_cache = token_cache or TokenCache()
+        self._http = None
+
+    def request(self, *args, **kwargs):
+        if self._http is None:
+            import httplib2
+            self._http = httplib2.Http()
+        return self._http.request(*args, **kwargs)
 
     def get_token(self):
         if self.auth_token:
             return self.auth_token
+        return self.token_cache.get(self._fetch_token)
+
+    def invalidate_token(self):
+        """Drops the cached token; returns False if it can not be renewed."""
+        if self.auth_token:
+            return False
+        self.token_cache.invalidate()
+        return True
+
+    def _fetch_token(self):
         headers = {'content-type': 'application/json'}
         request_body = json.dumps({"passwordCredentials":
                                        {"username": self.username,
@@ -83,4 +830,14 @@ class AuthorizationClient(httplib2.Http):
         if int(res.status) >= 400:
             raise Exception(_("Error occured while retrieving token : %s")
                               % body)
-        return json.loads(body)['auth']['token']['id']
+        token = json.loads(body)['auth']['token']
+        return token['id'], self._expires_at(token.get('expires'))
+
+    def _expires_at(self, expires):
+        """Parses the token's expiry; None lets the cache use its TTL."""
+        if not expires:
+            return None
+        try:
+            return utils.parse_isotime(expires)
+        except ValueError:
+            return None
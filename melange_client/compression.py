@@ -0,0 +1,103 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Content-Encoding support for request and response bodies."""
+
+import threading
+import time
+import zlib
+
+ACCEPT_ENCODING = "gzip, deflate"
+
+
+class Decoder(object):
+    """Incrementally decodes a gzip or deflate encoded body.
+
+    Servers disagree on whether "deflate" means a zlib stream or a raw
+    deflate stream, so both are accepted.
+
+    """
+
+    def __init__(self, encoding, stats=None):
+        self.encoding = encoding
+        self.stats = stats
+        if encoding == "gzip":
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decompressor = zlib.decompressobj()
+        self._started = False
+
+    def decode(self, data):
+        started = time.time()
+        try:
+            decoded = self._decompressor.decompress(data)
+        except zlib.error:
+            if self.encoding != "deflate" or self._started:
+                raise
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            decoded = self._decompressor.decompress(data)
+        self._started = self._started or bool(decoded)
+        if self.stats:
+            self.stats.record_decode(len(decoded), time.time() - started)
+        return decoded
+
+    def flush(self):
+        return self._decompressor.flush()
+
+
+def decoder(headers, stats=None):
+    """The Decoder for a response with headers, or None if it is plain."""
+    encoding = headers.get('content-encoding', "").strip().lower()
+    if encoding in ("gzip", "deflate"):
+        return Decoder(encoding, stats)
+    return None
+
+
+def gzip(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class TransferStats(object):
+    """Counts the bytes a transport moves and the time spent decoding."""
+
+    def __init__(self):
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.decode_time = 0.0
+        self._lock = threading.Lock()
+
+    def record_sent(self, count):
+        with self._lock:
+            self.bytes_sent += count
+
+    def record_received(self, count):
+        with self._lock:
+            self.bytes_received += count
+
+    def record_decode(self, count, seconds):
+        with self._lock:
+            self.bytes_decoded += count
+            self.decode_time += seconds
+
+    def stats(self):
+        with self._lock:
+            return dict(bytes_sent=self.bytes_sent,
+                        bytes_received=self.bytes_received,
+                        bytes_decoded=self.bytes_decoded,
+                        decode_time=self.decode_time)
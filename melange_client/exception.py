@@ -22,6 +22,10 @@ from openstack.common import exception as openstack_exception
 ClientConnectionError = openstack_exception.ClientConnectionError
 
 
+class CircuitOpenError(ClientConnectionError):
+    """Raised instead of sending a request to endpoints known to be down."""
+
+
 class MelangeClientError(Exception):
 
     def __init__(self, message):
@@ -37,5 +41,7 @@ class TemplateNotFoundError(Exception):
 
 class MelangeServiceResponseError(Exception):
 
-    def __init__(self, error):
+    def __init__(self, error, status=None, headers=None):
         super(MelangeServiceResponseError, self).__init__(error)
+        self.status = status
+        self.headers = headers or {}
@@ -0,0 +1,337 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Futures and a bounded thread pool to run client calls concurrently."""
+
+import Queue
+import sys
+import threading
+import time
+
+from melange_client import utils
+
+
+class CancelledError(Exception):
+
+    def __init__(self, message="future was cancelled"):
+        super(CancelledError, self).__init__(message)
+
+
+class TimeoutError(Exception):
+
+    def __init__(self, message="timed out waiting for future"):
+        super(TimeoutError, self).__init__(message)
+
+
+class Future(object):
+    """The result of a call that is run by an Executor."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    CANCELLED = "cancelled"
+    FINISHED = "finished"
+
+    def __init__(self):
+        self.state = self.PENDING
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._condition = threading.Condition()
+
+    def cancel(self):
+        """Cancels the call if it has not started yet.
+
+        Returns False when the call is already running or done.
+
+        """
+        with self._condition:
+            if self.state == self.CANCELLED:
+                return True
+            if self.state != self.PENDING:
+                return False
+            self.state = self.CANCELLED
+            self._condition.notify_all()
+        self._run_callbacks()
+        return True
+
+    def cancelled(self):
+        return self.state == self.CANCELLED
+
+    def running(self):
+        return self.state == self.RUNNING
+
+    def done(self):
+        return self.state in (self.CANCELLED, self.FINISHED)
+
+    def result(self, timeout=None):
+        self._wait(timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, fn):
+        with self._condition:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_running(self):
+        """Marks the future running; returns False if it was cancelled."""
+        with self._condition:
+            if self.state != self.PENDING:
+                return False
+            self.state = self.RUNNING
+            return True
+
+    def set_result(self, result):
+        self._finish(result=result)
+
+    def set_exception(self, exc_info):
+        self._finish(exc_info=exc_info)
+
+    def _finish(self, result=None, exc_info=None):
+        with self._condition:
+            self._result = result
+            self._exc_info = exc_info
+            self.state = self.FINISHED
+            self._condition.notify_all()
+        self._run_callbacks()
+
+    def _wait(self, timeout):
+        with self._condition:
+            if timeout is None:
+                while not self.done():
+                    self._condition.wait()
+            elif not self.done():
+                self._condition.wait(timeout)
+            if self.state == self.CANCELLED:
+                raise CancelledError()
+            if not self.done():
+                raise TimeoutError()
+
+    def _run_callbacks(self):
+        with self._condition:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class Executor(object):
+    """Runs calls on at most max_workers threads.
+
+    Worker threads are started as calls are submitted, so an idle executor
+    costs nothing. Calls waiting for a free worker can be cancelled through
+    their future.
+
+    """
+
+    def __init__(self, max_workers=10):
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._shutdown = False
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot submit calls after shutdown")
+            self._queue.put((future, fn, args, kwargs))
+            if len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        return future
+
+    def map(self, fn, iterable):
+        """Submits fn for every item; returns the futures in order."""
+        return [self.submit(fn, item) for item in iterable]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._shutdown = True
+            workers = list(self._workers)
+        for _worker in workers:
+            self._queue.put(None)
+        if wait:
+            for worker in workers:
+                worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+
+
+def spawn(fn, *args, **kwargs):
+    """Runs fn on a thread of its own right away; returns its future.
+
+    Unlike Executor.submit the call never waits for a free worker.
+
+    """
+    future = Future()
+
+    def run():
+        future.set_running()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception:
+            future.set_exception(sys.exc_info())
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+class SingleFlight(object):
+    """Runs one call per key at a time; concurrent callers share its result.
+
+    do returns a (result, shared) tuple, where shared tells the callers
+    that waited for someone else's call apart from the one that made it.
+
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            leader = key not in self._inflight
+            if leader:
+                self.calls += 1
+                self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+            future = self._inflight[key]
+        if not leader:
+            return future.result(), True
+
+        try:
+            future.set_result(fn())
+        except Exception:
+            future.set_exception(sys.exc_info())
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result(), False
+
+
+def as_completed(futures, timeout=None):
+    """Yields futures as they finish, regardless of submission order."""
+    finished = Queue.Queue()
+    futures = list(futures)
+    for future in futures:
+        future.add_done_callback(finished.put)
+    for _i in range(len(futures)):
+        try:
+            yield finished.get(timeout=timeout)
+        except Queue.Empty:
+            raise TimeoutError()
+
+
+class BatchResult(object):
+    """Outcome of running one call per item with run_batch.
+
+    results holds the return values in item order, with None for items
+    whose call failed; errors maps the index of each failed item to the
+    error it raised.
+
+    """
+
+    def __init__(self, items, results, errors, latencies, elapsed):
+        self.items = items
+        self.results = results
+        self.errors = errors
+        self.latencies = latencies
+        self.elapsed = elapsed
+
+    def failed_items(self):
+        return [self.items[index] for index in sorted(self.errors)]
+
+    def throughput(self):
+        """Calls completed per second."""
+        return len(self.items) / self.elapsed if self.elapsed else 0.0
+
+    def latency_percentile(self, percent):
+        return utils.percentile(self.latencies, percent)
+
+    def stats(self):
+        return dict(count=len(self.items),
+                    errors=len(self.errors),
+                    elapsed=self.elapsed,
+                    throughput=self.throughput(),
+                    p50=self.latency_percentile(50),
+                    p90=self.latency_percentile(90),
+                    p99=self.latency_percentile(99))
+
+
+def run_batch(fn, iterable, concurrency=10):
+    """Calls fn on every item with at most concurrency calls in flight.
+
+    A failing call does not stop the batch; its error is collected in the
+    returned BatchResult.
+
+    """
+    items = list(iterable)
+    latencies = [None] * len(items)
+
+    def timed(index, item):
+        started = time.time()
+        try:
+            return fn(item)
+        finally:
+            latencies[index] = time.time() - started
+
+    started = time.time()
+    with Executor(max_workers=concurrency) as pool:
+        futures = [pool.submit(timed, index, item)
+                   for index, item in enumerate(items)]
+        results = [None] * len(items)
+        errors = {}
+        for index, future in enumerate(futures):
+            error = future.exception()
+            if error is None:
+                results[index] = future.result()
+            else:
+                errors[index] = error
+    return BatchResult(items, results, errors, latencies,
+                       time.time() - started)
@@ -0,0 +1,79 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""When to send a duplicate of a slow read to a second endpoint."""
+
+import collections
+import threading
+
+from melange_client import retry
+from melange_client import utils
+
+
+class HedgePolicy(object):
+    """Decides when a GET gets a hedge request.
+
+    A hedge is sent once a GET has gone without a response for longer than
+    the given percentile of recent GET latencies, clamped to [min_delay,
+    max_delay]. Hedges come out of a budget that grows by budget_ratio for
+    every GET, so they add at most that fraction of extra load.
+
+    """
+
+    def __init__(self, percentile=95, min_delay=0.005, max_delay=1.0,
+                 budget_ratio=0.05, window=1000):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = retry.RetryBudget(ratio=budget_ratio,
+                                        min_per_second=0,
+                                        max_tokens=5)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+        self.budget.record_request()
+
+    def delay(self):
+        """Seconds to wait for a response before hedging."""
+        with self._lock:
+            latency = utils.percentile(self._latencies, self.percentile)
+        if latency is None:
+            return self.max_delay
+        return min(self.max_delay, max(self.min_delay, latency))
+
+    def try_hedge(self):
+        if not self.budget.try_withdraw():
+            return False
+        with self._lock:
+            self.hedges += 1
+        return True
+
+    def record_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self):
+        delay = self.delay()
+        with self._lock:
+            return dict(hedges=self.hedges,
+                        hedge_wins=self.hedge_wins,
+                        delay=delay)
@@ -16,10 +16,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import inspect
-
 
 class MethodInspector(object):
+    """Describes the arguments of a function or method.
+
+    inspect is imported on first use; loading it is a noticeable share of
+    the CLI's startup time and most commands never need it.
+
+    """
 
     def __init__(self, func):
         self._func = func
@@ -38,12 +42,14 @@ class MethodInspector(object):
         return len(self.args()) - len(self.defaults())
 
     def args(self):
+        import inspect
         args = self.argspec().args
         if inspect.ismethod(self._func):
             args.pop(0)
         return args
 
     def argspec(self):
+        import inspect
         return inspect.getargspec(self._func)
 
     def __str__(self):
@@ -62,13 +68,25 @@ class ClassInspector(object):
         """Gets callable public methods.
 
         Get all callable methods of an object that don't start with underscore
+        and are not marked with not_a_cli_action;
         returns a dictionary of the form dict(method_name, method)
 
         """
 
         def is_public_method(attr):
-            return (callable(getattr(self.obj, attr))
-                    and not attr.startswith('_'))
+            method = getattr(self.obj, attr)
+            return (callable(method) and not attr.startswith('_')
+                    and getattr(method, 'cli_action', True))
 
         return dict((attr, getattr(self.obj, attr)) for attr in dir(self.obj)
                     if is_public_method(attr))
+
+
+def not_a_cli_action(fn):
+    """Keeps a public client method out of the actions the CLI offers.
+
+    For methods whose arguments can not be given as field=value strings.
+
+    """
+    fn.cli_action = False
+    return fn
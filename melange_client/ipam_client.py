@@ -15,18 +15,55 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import copy
+import functools
+import httplib
 import json
 import sys
+import threading
+import time
 import urlparse
 
 from melange_client import client
+from melange_client import exception
+from melange_client import executor
+from melange_client import inspector
+from melange_client import jsonstream
+from melange_client import tracing
 from melange_client import utils
 
 
 class Factory(object):
+    """Builds category clients that share one transport and auth client.
+
+    host may list several API endpoints, as "host1,host2:port" or a list;
+    requests are then balanced across them.
+
+    The HTTP client, with its connection pool, and the authorization client
+    are created on first use; category clients are created once per
+    factory. Call close(), or use the factory as a context manager, to
+    release pooled connections.
+
+    Pass a cache.ResponseCache as response_cache to cache the results of
+    find and all; writes through the same resource invalidate them.
+    compress_min_size gzips request bodies of at least that many bytes.
+    Each of timing_hooks is called with the timing.RequestTiming of every
+    request sent. Pass a metrics.ClientMetrics as metrics to collect
+    request, error, latency, retry, pool, circuit breaker and token cache
+    metrics. With a
+    tracing.Tracer as tracer, every call on a category client is traced.
+    A slowlog.SlowRequestLog as slow_log logs requests that take too long.
+
+    """
 
     def __init__(self, host, port, timeout=None, auth_url=None, username=None,
-                 api_key=None, auth_token=None, tenant_id=None):
+                 api_key=None, auth_token=None, tenant_id=None,
+                 token_cache=None, pool=None, retry_policy=None,
+                 breaker_options=None, hedge_policy=None, rate_limiter=None,
+                 concurrency_limit=None, coalesce_gets=False,
+                 response_cache=None, compress_min_size=None,
+                 timing_hooks=None, metrics=None, tracer=None,
+                 slow_log=None):
         self.host = host
         self.port = port
         self.timeout = timeout
@@ -35,27 +72,211 @@ class Factory(object):
         self.api_key = api_key
         self.auth_token = auth_token
         self.tenant_id = tenant_id
+        self.token_cache = token_cache or client.TokenCache()
+        self.pool = pool
+        self.retry_policy = retry_policy
+        self.breaker_options = breaker_options
+        self.hedge_policy = hedge_policy
+        self.rate_limiter = rate_limiter
+        self.concurrency_limit = concurrency_limit
+        self.coalesce_gets = coalesce_gets
+        self.response_cache = response_cache
+        self.compress_min_size = compress_min_size
+        self.timing_hooks = timing_hooks
+        self.metrics = metrics
+        self.tracer = tracer
+        self.slow_log = slow_log
+        self._http_client = None
+        self._authorization_client = None
+        self._clients = {}
+        self._lock = threading.RLock()
 
     def _auth_client(self):
-        if self.auth_url or self.auth_token:
-            return client.AuthorizationClient(self.auth_url,
-                                                   self.username,
-                                                   self.api_key,
-                                                   self.auth_token)
+        if not (self.auth_url or self.auth_token):
+            return None
+        with self._lock:
+            if self._authorization_client is None:
+                self._authorization_client = client.AuthorizationClient(
+                    self.auth_url,
+                    self.username,
+                    self.api_key,
+                    self.auth_token,
+                    self.token_cache)
+            return self._authorization_client
 
     def _client(self):
-        return client.HTTPClient(self.host,
-                                      self.port,
-                                      self.timeout)
+        with self._lock:
+            if self._http_client is None:
+                endpoints = utils.parse_endpoints(self.host, self.port)
+                kwargs = utils.remove_nones(
+                    dict(timeout=self.timeout,
+                         pool=self.pool,
+                         retry_policy=self.retry_policy,
+                         breaker_options=self.breaker_options,
+                         hedge_policy=self.hedge_policy,
+                         rate_limiter=self.rate_limiter,
+                         concurrency_limit=self.concurrency_limit,
+                         response_cache=self.response_cache,
+                         compress_min_size=self.compress_min_size,
+                         timing_hooks=self.timing_hooks,
+                         metrics=self.metrics,
+                         tracer=self.tracer,
+                         slow_log=self.slow_log))
+                if self.coalesce_gets:
+                    kwargs['single_flight'] = executor.SingleFlight()
+                self._http_client = client.HTTPClient(endpoints[0][0],
+                                                      endpoints[0][1],
+                                                      endpoints=endpoints,
+                                                      **kwargs)
+                if self.metrics:
+                    self.metrics.watch_pool(self._http_client.pool)
+                    self.metrics.watch_breakers(self._http_client.balancer)
+                    self.metrics.watch_token_cache(self.token_cache)
+            return self._http_client
 
     def __getattr__(self, item):
+        if item.startswith('_'):
+            raise AttributeError(item)
         class_name = utils.camelize(item) + "Client"
         cls = getattr(sys.modules[__name__], class_name, None)
         if cls is None:
             raise AttributeError("%s has no attribute %s" %
                                  (self.__class__.__name__, item))
 
-        return cls(self._client(), self._auth_client(), self.tenant_id)
+        with self._lock:
+            if item not in self._clients:
+                category_client = cls(self._client(),
+                                      self._auth_client(),
+                                      self.tenant_id)
+                if self.tracer:
+                    category_client = TracedClient(category_client,
+                                                   self.tracer, item)
+                self._clients[item] = category_client
+            return self._clients[item]
+
+    def map(self, fn, iterable, concurrency=10):
+        """Calls fn on every item concurrently and returns a BatchResult.
+
+        fn should make its calls through this factory's clients so that
+        they share its pooled connections and cached token. The connection
+        pool is grown to keep at least concurrency idle connections, so
+        that the calls do not keep opening and evicting them.
+
+        """
+        self._client().pool.grow(concurrency)
+        return executor.run_batch(fn, iterable, concurrency)
+
+    def close(self):
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+                if self.metrics:
+                    self.metrics.unwatch(self._http_client.pool,
+                                         self._http_client.balancer,
+                                         self.token_cache)
+            self._http_client = None
+            self._clients.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncFactory(Factory):
+    """Factory whose clients return Futures instead of blocking.
+
+    Calls run on a shared executor with at most concurrency of them in
+    flight; the connection pool keeps one keep-alive connection per worker.
+    Calls still waiting for a worker can be cancelled through their future.
+    close() stops the executor; the factory starts a new one if it is used
+    again.
+
+    """
+
+    def __init__(self, host, port, concurrency=10, **kwargs):
+        kwargs.setdefault('pool', client.ConnectionPool(max_size=concurrency))
+        super(AsyncFactory, self).__init__(host, port, **kwargs)
+        self.concurrency = concurrency
+        self._executor = None
+        self._async_clients = {}
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = executor.Executor(
+                    max_workers=self.concurrency)
+            return self._executor
+
+    def __getattr__(self, item):
+        sync_client = super(AsyncFactory, self).__getattr__(item)
+        with self._lock:
+            if item not in self._async_clients:
+                self._async_clients[item] = AsyncClient(sync_client,
+                                                        self.executor)
+            return self._async_clients[item]
+
+    def close(self):
+        with self._lock:
+            pool, self._executor = self._executor, None
+            self._async_clients.clear()
+        if pool is not None:
+            pool.shutdown()
+        super(AsyncFactory, self).close()
+
+
+class AsyncClient(object):
+    """Wraps a client so that its public methods return Futures.
+
+    Works the same for category clients, Resource and HTTPClient; methods
+    keep their names and arguments and are run on the given executor.
+
+    """
+
+    def __init__(self, client, executor):
+        self.client = client
+        self.executor = executor
+        self.TENANT_ID_REQUIRED = getattr(client, 'TENANT_ID_REQUIRED', False)
+
+    def __getattr__(self, item):
+        method = getattr(self.client, item)
+        if item.startswith('_') or not callable(method):
+            return method
+
+        @functools.wraps(method)
+        def submit(*args, **kwargs):
+            return self.executor.submit(method, *args, **kwargs)
+
+        return submit
+
+
+class TracedClient(object):
+    """Wraps a category client so that each call runs in a tracing span.
+
+    Spans are named after the category and method, like "ip_block.create".
+    Methods that return generators are only traced until they return.
+
+    """
+
+    def __init__(self, client, tracer, category):
+        self.client = client
+        self.tracer = tracer
+        self.category = category
+        self.TENANT_ID_REQUIRED = getattr(client, 'TENANT_ID_REQUIRED', False)
+
+    def __getattr__(self, item):
+        method = getattr(self.client, item)
+        if item.startswith('_') or not callable(method):
+            return method
+
+        @functools.wraps(method)
+        def traced(*args, **kwargs):
+            with self.tracer.span("%s.%s" % (self.category, item)):
+                return method(*args, **kwargs)
+
+        return traced
 
 
 class Resource(object):
@@ -67,6 +288,7 @@ class Resource(object):
         self.name = name
         self.client = client
         self.auth_client = auth_client
+        self.tenant_id = tenant_id
 
     def create(self, **kwargs):
         return self.request("POST",
@@ -80,12 +302,69 @@ class Resource(object):
                                 {self.name: utils.remove_nones(kwargs)}))
 
     def all(self, **params):
-        return self.request("GET",
-                            self.path,
-                            params=utils.remove_nones(params))
+        return self._cached_get(self.path, params=utils.remove_nones(params))
+
+    def iter_all(self, limit=100, **params):
+        """Yields every member of the collection, a page at a time.
+
+        Pages of up to limit members are requested with the marker/limit
+        query parameters. The next page is fetched in the background while
+        the current one is being consumed.
+
+        """
+        limit = int(limit)
+        params = utils.remove_nones(params)
+        pool = executor.Executor(max_workers=1)
+        try:
+            page = self._page(params, None, limit)
+            while True:
+                next_page = None
+                if len(page) == limit:
+                    next_page = pool.submit(self._page, params,
+                                            page[-1]['id'], limit)
+                for member in page:
+                    yield member
+                if next_page is None:
+                    return
+                marker = page[-1]['id']
+                page = next_page.result()
+                if page and page[-1]['id'] == marker:
+                    return
+        finally:
+            pool.shutdown(wait=False)
+
+    def stream_all(self, **params):
+        """Yields the members of the collection as they are decoded.
+
+        The response is parsed off the socket as it arrives, so neither the
+        raw body nor the whole decoded list is ever held in memory. The
+        request is retried after a token refresh, and recorded in metrics
+        and the slow log, like any other; both see it end once the headers
+        have arrived.
+
+        """
+        response = self._response("GET", self.path,
+                                  params=utils.remove_nones(params),
+                                  stream=True)
+        try:
+            for member in jsonstream.iter_items(response.iter_chunks()):
+                yield member
+        finally:
+            response.close()
+
+    def _page(self, params, marker, limit):
+        params = utils.remove_nones(dict(params, marker=marker, limit=limit))
+        return self._members(self.request("GET", self.path, params=params))
+
+    def _members(self, result):
+        """Finds the list of members in a collection response."""
+        for key, value in (result or {}).iteritems():
+            if isinstance(value, list) and not key.endswith("_links"):
+                return value
+        return []
 
     def find(self, id):
-        return self.request("GET", self._member_path(id))
+        return self._cached_get(self._member_path(id))
 
     def delete(self, id):
         return self.request("DELETE", self._member_path(id))
@@ -93,13 +372,114 @@ class Resource(object):
     def _member_path(self, id):
         return "{0}/{1}".format(self.path, id)
 
+    def _cached_get(self, path, **kwargs):
+        cache = self.client.response_cache
+        if not (cache and cache.ttl_for(self.name)):
+            return self.request("GET", path, **kwargs)
+
+        key = self._request_key(path, kwargs.get('params'))
+        entry = cache.get(key)
+        if entry is not None:
+            return copy.deepcopy(entry.value)
+        return self._coalesced(key, lambda: self._revalidate(path, key,
+                                                             **kwargs))
+
+    def _revalidate(self, path, key, **kwargs):
+        """Fetches path, sending the validators of the cached response."""
+        cache = self.client.response_cache
+        validators = cache.validators(key)
+        if validators:
+            response = self._response("GET", path, headers=validators,
+                                      **kwargs)
+            if response.status == httplib.NOT_MODIFIED:
+                entry = cache.refresh(self.name, key)
+                if entry is not None:
+                    return copy.deepcopy(entry.value)
+                response = self._response("GET", path, **kwargs)
+        else:
+            response = self._response("GET", path, **kwargs)
+
+        result = self._decode(response.read())
+        cache.put(self.name, key, copy.deepcopy(result),
+                  etag=response.getheader('etag'),
+                  last_modified=response.getheader('last-modified'))
+        return result
+
+    def _request_key(self, path, params):
+        return (path, tuple(sorted((params or {}).items())), self.tenant_id)
+
     def request(self, method, path, **kwargs):
-        kwargs['headers'] = {'Content-Type': "application/json"}
+        if method != "GET":
+            try:
+                return self._request(method, path, **kwargs)
+            finally:
+                if self.client.response_cache:
+                    self.client.response_cache.invalidate(self.path)
+
+        return self._coalesced(self._request_key(path, kwargs.get('params')),
+                               lambda: self._request(method, path, **kwargs))
+
+    def _coalesced(self, key, fn):
+        """Runs fn once for concurrent callers with the same key.
+
+        Every caller, the one that ran fn included, gets its own copy of
+        the result, so none of them can change what the others see.
+
+        """
+        single_flight = self.client.single_flight
+        if not single_flight:
+            return fn()
+        result, _shared = single_flight.do(key, fn)
+        return copy.deepcopy(result)
+
+    def _request(self, method, path, **kwargs):
+        return self._decode(self._response(method, path, **kwargs).read())
+
+    def _response(self, method, path, **kwargs):
+        metrics = self.client.metrics
+        slow_log = self.client.slow_log
+        if not (metrics or slow_log):
+            return self._authorized_response(method, path, **kwargs)
+
+        slow_call = slow_log.start() if slow_log else None
+        started = time.time()
+        response = error = None
+        try:
+            response = self._authorized_response(method, path, **kwargs)
+        except Exception as failure:
+            error = failure
+            raise
+        finally:
+            if metrics:
+                metrics.record_request(self.name, method,
+                                       time.time() - started, error)
+            if slow_call:
+                slow_call.finish(method, path, self.tenant_id,
+                                 error or response)
+        return response
+
+    def _authorized_response(self, method, path, **kwargs):
+        try:
+            return self._do_request(method, path, **kwargs)
+        except exception.MelangeServiceResponseError as error:
+            if not (error.status == 401 and self.auth_client
+                    and self.auth_client.invalidate_token()):
+                raise
+            return self._do_request(method, path, **kwargs)
+
+    def _decode(self, body):
+        if body:
+            with tracing.maybe_span(self.client.tracer, "decode"):
+                return json.loads(body)
+
+    def _do_request(self, method, path, headers=None, **kwargs):
+        kwargs['headers'] = dict(headers or {})
+        kwargs['headers']['Content-Type'] = "application/json"
         if self.auth_client:
-            kwargs['headers']['X-AUTH-TOKEN'] = self.auth_client.get_token()
-        result = self.client.do_request(method, path, **kwargs).read()
-        if result:
-            return json.loads(result)
+            with tracing.maybe_span(self.client.tracer, "auth"):
+                token = self.auth_client.get_token()
+            kwargs['headers']['X-AUTH-TOKEN'] = token
+        return self.client.do_request(method, path, **kwargs)
 
 
 class BaseClient(object):
@@ -130,6 +510,12 @@ class IpBlockClient(BaseClient):
     def list(self):
         return self.resource.all()
 
+    def iter_all(self, limit=100):
+        return self.resource.iter_all(limit=limit)
+
+    def stream_list(self):
+        return self.resource.stream_all()
+
     def show(self, id):
         return self.resource.find(id)
 
@@ -158,6 +544,12 @@ class SubnetClient(BaseClient):
     def list(self, parent_id):
         return self._resource(parent_id).all()
 
+    def iter_all(self, parent_id, limit=100):
+        return self._resource(parent_id).iter_all(limit=limit)
+
+    def stream_list(self, parent_id):
+        return self._resource(parent_id).stream_all()
+
 
 class PolicyClient(BaseClient):
 
@@ -177,6 +569,12 @@ class PolicyClient(BaseClient):
     def list(self):
         return self.resource.all()
 
+    def iter_all(self, limit=100):
+        return self.resource.iter_all(limit=limit)
+
+    def stream_list(self):
+        return self.resource.stream_all()
+
     def show(self, id):
         return self.resource.find(id)
 
@@ -204,6 +602,12 @@ class UnusableIpRangeClient(BaseClient):
     def list(self, policy_id):
         return self._resource(policy_id).all()
 
+    def iter_all(self, policy_id, limit=100):
+        return self._resource(policy_id).iter_all(limit=limit)
+
+    def stream_list(self, policy_id):
+        return self._resource(policy_id).stream_all()
+
     def show(self, policy_id, id):
         return self._resource(policy_id).find(id)
 
@@ -229,6 +633,12 @@ class UnusableIpOctetClient(BaseClient):
     def list(self, policy_id):
         return self._resource(policy_id).all()
 
+    def iter_all(self, policy_id, limit=100):
+        return self._resource(policy_id).iter_all(limit=limit)
+
+    def stream_list(self, policy_id):
+        return self._resource(policy_id).stream_all()
+
     def show(self, policy_id, id):
         return self._resource(policy_id).find(id)
 
@@ -250,6 +660,13 @@ class AllocatedIpClient(BaseClient):
     def list(self, used_by_device=None):
         return self._resource.all(used_by_device=used_by_device)
 
+    def stream_list(self, used_by_device=None):
+        return self._resource.stream_all(used_by_device=used_by_device)
+
+    def iter_all(self, used_by_device=None, limit=100):
+        return self._resource.iter_all(limit=limit,
+                                       used_by_device=used_by_device)
+
 
 class IpAddressClient(BaseClient):
 
@@ -269,9 +686,39 @@ class IpAddressClient(BaseClient):
                                used_by_device=used_by_device,
                                tenant_id=used_by_tenant)
 
+    @inspector.not_a_cli_action
+    def create_many(self, ip_block_id, specs, concurrency=10):
+        """Allocates one address per spec, yielding each as it completes.
+
+        specs are dicts of create's keyword arguments. Yields (spec, result,
+        error) tuples where error is None for successful allocations, so
+        that only the failed specs need to be retried. Not offered by the
+        CLI, which can only pass strings.
+
+        """
+        pool = executor.Executor(max_workers=concurrency)
+        futures = {}
+        try:
+            for spec in specs:
+                futures[pool.submit(self.create, ip_block_id, **spec)] = spec
+            for future in executor.as_completed(futures):
+                error = future.exception()
+                result = future.result() if error is None else None
+                yield futures[future], result, error
+        finally:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+
     def list(self, ip_block_id):
         return self._resource(ip_block_id).all()
 
+    def iter_all(self, ip_block_id, limit=100):
+        return self._resource(ip_block_id).iter_all(limit=limit)
+
+    def stream_list(self, ip_block_id):
+        return self._resource(ip_block_id).stream_all()
+
     def show(self, ip_block_id, address):
         return self._resource(ip_block_id).find(address)
 
@@ -298,6 +745,12 @@ class IpRouteClient(BaseClient):
     def list(self, ip_block_id):
         return self._resource(ip_block_id).all()
 
+    def iter_all(self, ip_block_id, limit=100):
+        return self._resource(ip_block_id).iter_all(limit=limit)
+
+    def stream_list(self, ip_block_id):
+        return self._resource(ip_block_id).stream_all()
+
     def show(self, ip_block_id, id):
         return self._resource(ip_block_id).find(id)
 
@@ -352,6 +805,12 @@ class MacAddressRangeClient(BaseClient):
     def list(self):
         return self._resource.all()
 
+    def iter_all(self, limit=100):
+        return self._resource.iter_all(limit=limit)
+
+    def stream_list(self):
+        return self._resource.stream_all()
+
     def delete(self, id):
         return self._resource.delete(id)
 
@@ -380,5 +839,11 @@ class AllowedIpClient(BaseClient):
     def list(self, interface_id):
         return self._resource(interface_id).all()
 
+    def iter_all(self, interface_id, limit=100):
+        return self._resource(interface_id).iter_all(limit=limit)
+
+    def stream_list(self, interface_id):
+        return self._resource(interface_id).stream_all()
+
     def delete(self, interface_id, ip_address):
         return self._resource(interface_id).delete(ip_address)
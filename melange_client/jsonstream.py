@@ -0,0 +1,154 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Incremental decoding of the member array in JSON collection responses."""
+
+import json
+import re
+
+_TOKEN = re.compile(r'[\[\]{}",]')
+_STRING_END = re.compile(r'["\\]')
+
+
+def iter_items(chunks, key=None):
+    """Yields the members of an array in a JSON object as they arrive.
+
+    chunks is an iterable of strings that together make up a JSON object.
+    The members of its key array, or of its first array when key is None,
+    are decoded one at a time so the whole body is never held in memory.
+
+    """
+    scanner = ArrayScanner(key)
+    for chunk in chunks:
+        for item in scanner.feed(chunk):
+            yield item
+    scanner.close()
+
+
+class ArrayScanner(object):
+    """Finds the members of one array in a JSON object fed in pieces.
+
+    Only the structure of the document is tracked; each member is handed to
+    json.loads as soon as the comma or bracket ending it has been seen.
+
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.string_start = None
+        self.expect_key = False
+        self.current_key = None
+        self.in_array = False
+        self.item_start = None
+        self.finished = False
+
+    def feed(self, chunk):
+        """Returns the members completed by chunk."""
+        if self.finished:
+            return []
+        self.buffer += chunk
+        items = []
+        while not self.finished:
+            if self.in_string:
+                if not self._scan_string():
+                    break
+                continue
+            match = _TOKEN.search(self.buffer, self.pos)
+            if not match:
+                self.pos = len(self.buffer)
+                break
+            self.pos = match.end()
+            self._token(match.group(), match.start(), items)
+        self._trim()
+        return items
+
+    def close(self):
+        if self.in_array and not self.finished:
+            raise ValueError("JSON document ended inside the member array")
+
+    def _scan_string(self):
+        match = _STRING_END.search(self.buffer, self.pos)
+        if not match:
+            self.pos = len(self.buffer)
+            return False
+        if match.group() == "\\":
+            if match.end() >= len(self.buffer):
+                self.pos = match.start()
+                return False
+            self.pos = match.end() + 1
+            return True
+        self.in_string = False
+        self.pos = match.end()
+        if self.depth == 1 and self.expect_key:
+            self.current_key = json.loads(
+                self.buffer[self.string_start:self.pos])
+            self.expect_key = False
+        return True
+
+    def _token(self, char, index, items):
+        if char == '"':
+            self.in_string = True
+            self.string_start = index
+        elif char in "{[":
+            self.depth += 1
+            if self.depth == 1:
+                self.expect_key = char == "{"
+            elif (char == "[" and self.depth == 2 and not self.in_array
+                  and self._wanted(self.current_key)):
+                self.in_array = True
+                self.item_start = index + 1
+        elif char in "}]":
+            if self.in_array and self.depth == 2:
+                self._add_item(index, items)
+                self.finished = True
+            self.depth -= 1
+        elif char == ",":
+            if self.in_array and self.depth == 2:
+                self._add_item(index, items)
+                self.item_start = index + 1
+            elif self.depth == 1:
+                self.expect_key = True
+
+    def _wanted(self, key):
+        if self.key is None:
+            return not (key or "").endswith("_links")
+        return key == self.key
+
+    def _add_item(self, end, items):
+        text = self.buffer[self.item_start:end].strip()
+        if text:
+            items.append(json.loads(text))
+
+    def _trim(self):
+        if self.finished:
+            self.buffer = ""
+            return
+        keep = self.pos
+        if self.in_string:
+            keep = min(keep, self.string_start)
+        if self.in_array:
+            keep = min(keep, self.item_start)
+        self.buffer = self.buffer[keep:]
+        self.pos -= keep
+        if self.string_start is not None:
+            self.string_start -= keep
+        if self.item_start is not None:
+            self.item_start -= keep
@@ -0,0 +1,129 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Client-side limits that keep the load on the Melange server in check."""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Allows rate requests per second, with bursts of up to burst."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._refilled_at = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, sleeping until one is available."""
+        while True:
+            wait = self.try_acquire()
+            if wait is None:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """Takes a token; returns seconds to wait when there is none."""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+            return (1 - self._tokens) / self.rate
+
+
+class RateLimiter(object):
+    """Token buckets per endpoint and per tenant.
+
+    Either rate may be None to leave that dimension unlimited.
+
+    """
+
+    def __init__(self, endpoint_rate=None, tenant_rate=None, burst=None):
+        self.endpoint_rate = endpoint_rate
+        self.tenant_rate = tenant_rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint, tenant=None):
+        if self.endpoint_rate:
+            self._bucket(("endpoint", endpoint), self.endpoint_rate).acquire()
+        if self.tenant_rate and tenant:
+            self._bucket(("tenant", tenant), self.tenant_rate).acquire()
+
+    def _bucket(self, key, rate):
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(rate, self.burst)
+            return self._buckets[key]
+
+
+class AdaptiveConcurrencyLimit(object):
+    """Limits requests in flight, adapting the limit to server latency.
+
+    The limit grows additively, by about one per limit requests, while
+    latency stays within tolerance times the baseline, and shrinks
+    multiplicatively by backoff_ratio when latency rises above it or the
+    server reports overload. The baseline follows the lowest latency seen,
+    drifting slowly upwards so that it can follow a lasting change.
+
+    """
+
+    def __init__(self, initial_limit=10, min_limit=1, max_limit=200,
+                 tolerance=2.0, backoff_ratio=0.9, drift=0.01):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff_ratio = backoff_ratio
+        self.drift = drift
+        self.baseline = None
+        self.inflight = 0
+        self._condition = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        with self._condition:
+            while self.inflight >= int(self.limit):
+                self._condition.wait()
+            self.inflight += 1
+
+    def release(self, latency, overloaded=False):
+        with self._condition:
+            self.inflight -= 1
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+            else:
+                self.baseline += (latency - self.baseline) * self.drift
+            if overloaded or latency > self.baseline * self.tolerance:
+                self.limit = max(self.min_limit,
+                                 self.limit * self.backoff_ratio)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return dict(limit=int(self.limit),
+                        inflight=self.inflight,
+                        baseline=self.baseline)
@@ -0,0 +1,408 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Client-side metrics, exportable as Prometheus text or statsd packets."""
+
+import bisect
+import collections
+import socket
+import threading
+
+from melange_client import breaker
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+class _Metric(object):
+    """A metric whose samples are kept in one shard per thread.
+
+    Updates only touch the calling thread's shard, so they take no lock;
+    the shards are summed when the metric is collected. The shards of
+    threads that have exited are folded into a retired one, so short-lived
+    worker threads do not pile up.
+
+    """
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._retire_at = 16
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) >= self._retire_at:
+                    self._retire_dead_shards()
+                    self._retire_at = max(16, len(self._shards) * 2)
+            return shard
+
+    def _shard_items(self):
+        with self._lock:
+            self._retire_dead_shards()
+            shards = [self._retired] + [shard for _thread, shard
+                                        in self._shards]
+            items = [item for shard in shards for item in shard.items()]
+        return items
+
+    def _retire_dead_shards(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+                continue
+            for labels, value in shard.iteritems():
+                if labels in self._retired:
+                    self._retired[labels] = self._merge(self._retired[labels],
+                                                        value)
+                else:
+                    self._retired[labels] = value
+        self._shards = live
+
+    def _merge(self, retired, value):
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+
+    type = "counter"
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, retired, value):
+        return retired + value
+
+    def collect(self):
+        """Maps each label tuple to its value."""
+        totals = collections.defaultdict(int)
+        for labels, value in self._shard_items():
+            totals[labels] += value
+        return dict(totals)
+
+
+class Histogram(_Metric):
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        sample = shard.get(labels)
+        if sample is None:
+            sample = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        sample[0][bisect.bisect_left(self.buckets, value)] += 1
+        sample[1] += value
+        sample[2] += 1
+
+    def _merge(self, retired, value):
+        return [[a + b for a, b in zip(retired[0], value[0])],
+                retired[1] + value[1], retired[2] + value[2]]
+
+    def collect(self):
+        """Maps each label tuple to (cumulative bucket counts, sum, count).
+
+        The last bucket count is for +Inf.
+
+        """
+        totals = {}
+        for labels, (counts, total, count) in self._shard_items():
+            if labels not in totals:
+                totals[labels] = [[0] * len(counts), 0.0, 0]
+            merged = totals[labels]
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+        result = {}
+        for labels, (counts, total, count) in totals.iteritems():
+            cumulative = []
+            for bucket_count in counts:
+                cumulative.append(bucket_count +
+                                  (cumulative[-1] if cumulative else 0))
+            result[labels] = (cumulative, total, count)
+        return result
+
+
+class Gauge(_Metric):
+    """A metric read from fn when collected.
+
+    fn returns either a number or a dict mapping label tuples to numbers.
+
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, help, fn, labelnames=()):
+        super(Gauge, self).__init__(name, help, labelnames)
+        self.fn = fn
+
+    def collect(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            return value
+        return {(): value}
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labelnames,
+                              buckets=buckets)
+
+    def gauge(self, name, help, fn, labelnames=()):
+        return self._register(Gauge, name, help, fn, labelnames)
+
+    def metrics(self):
+        with self._lock:
+            return self._metrics.values()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+
+class ClientMetrics(object):
+    """The metrics collected by Resource and HTTPClient.
+
+    Pass one to Factory(metrics=...), which also has it watch the
+    connection pool, circuit breakers and token cache; export its registry
+    with
+    prometheus_text or a StatsdExporter.
+
+    """
+
+    def __init__(self, registry=None, buckets=DEFAULT_BUCKETS):
+        self.registry = registry or Registry()
+        self.requests = self.registry.counter(
+            "melange_client_requests_total",
+            "Requests made through category clients.",
+            ("resource", "method"))
+        self.errors = self.registry.counter(
+            "melange_client_request_errors_total",
+            "Failed requests, by response status or error type.",
+            ("resource", "method", "status"))
+        self.latency = self.registry.histogram(
+            "melange_client_request_duration_seconds",
+            "Time taken by requests, including retries.",
+            ("resource", "method"), buckets)
+        self.retries = self.registry.counter(
+            "melange_client_retries_total",
+            "Requests retried by the HTTP transport.",
+            ("method",))
+        self._watched = dict(pools=[], balancers=[], token_caches=[])
+        self._lock = threading.Lock()
+
+    def record_request(self, resource, method, seconds, error=None):
+        labels = (resource, method)
+        self.requests.inc(labels)
+        self.latency.observe(seconds, labels)
+        if error is not None:
+            status = getattr(error, 'status', None) or type(error).__name__
+            self.errors.inc(labels + (str(status),))
+
+    def record_retry(self, method):
+        self.retries.inc((method,))
+
+    def watch_pool(self, pool):
+        self._watch('pools', pool)
+        self.registry.gauge(
+            "melange_client_pool_connections",
+            "Pooled connections, by state.",
+            self._pool_connections,
+            ("state",))
+
+    def watch_breakers(self, balancer):
+        self._watch('balancers', balancer)
+        self.registry.gauge(
+            "melange_client_circuit_state",
+            "1 for the state each endpoint's circuit breaker is in, else 0.",
+            self._circuit_states,
+            ("endpoint", "state"))
+
+    def watch_token_cache(self, token_cache):
+        self._watch('token_caches', token_cache)
+        self.registry.gauge(
+            "melange_client_token_cache_hit_rate",
+            "Share of token lookups served from the cache.",
+            self._token_cache_hit_rate)
+
+    def unwatch(self, *watched):
+        """Stops reporting on the given pools, balancers or token caches.
+
+        Factory.close calls this, so that the gauges only cover the
+        transports that are still in use. Gauges add up everything that is
+        being watched, so several factories can share one ClientMetrics.
+
+        """
+        with self._lock:
+            for sources in self._watched.values():
+                for source in watched:
+                    if source in sources:
+                        sources.remove(source)
+
+    def _watch(self, kind, source):
+        with self._lock:
+            if source not in self._watched[kind]:
+                self._watched[kind].append(source)
+
+    def _sources(self, kind):
+        with self._lock:
+            return list(self._watched[kind])
+
+    def _pool_connections(self):
+        totals = dict(in_use=0, idle=0)
+        for pool in self._sources('pools'):
+            stats = pool.stats()
+            for state in totals:
+                totals[state] += stats[state]
+        return dict(((state,), count) for state, count in totals.items())
+
+    def _circuit_states(self):
+        states = {}
+        for balancer in self._sources('balancers'):
+            for endpoint in balancer.endpoints:
+                for state in breaker.CircuitBreaker.STATES:
+                    labels = (repr(endpoint), state)
+                    states[labels] = max(states.get(labels, 0),
+                                         int(endpoint.breaker.state == state))
+        return states
+
+    def _token_cache_hit_rate(self):
+        hits = lookups = 0
+        for token_cache in self._sources('token_caches'):
+            stats = token_cache.stats()
+            hits += stats['hits']
+            lookups += stats['hits'] + stats['misses']
+        return float(hits) / lookups if lookups else 0.0
+
+
+def prometheus_text(registry):
+    """Renders the registry in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry.metrics():
+        lines.append("# HELP %s %s" % (metric.name, metric.help))
+        lines.append("# TYPE %s %s" % (metric.name, metric.type))
+        for labels, value in sorted(metric.collect().items()):
+            pairs = zip(metric.labelnames, labels)
+            if metric.type != "histogram":
+                lines.append(_sample(metric.name, pairs, value))
+                continue
+            counts, total, count = value
+            bounds = [repr(bound) for bound in metric.buckets] + ["+Inf"]
+            for bound, bucket_count in zip(bounds, counts):
+                lines.append(_sample(metric.name + "_bucket",
+                                     pairs + [("le", bound)], bucket_count))
+            lines.append(_sample(metric.name + "_sum", pairs, total))
+            lines.append(_sample(metric.name + "_count", pairs, count))
+    return "\n".join(lines) + "\n"
+
+
+def _sample(name, pairs, value):
+    if pairs:
+        name += "{%s}" % ",".join('%s="%s"' % (key, _escape(label))
+                                  for key, label in pairs)
+    return "%s %s" % (name, repr(float(value)))
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+class StatsdExporter(object):
+    """Sends the registry's metrics to statsd over UDP.
+
+    Counters and histogram sums and counts are sent as counters holding
+    the change since the previous flush; gauges are sent as gauges.
+
+    """
+
+    def __init__(self, host="localhost", port=8125, prefix="melange_client",
+                 max_packet_size=512):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.max_packet_size = max_packet_size
+        self._sent = {}
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._lock = threading.Lock()
+
+    def flush(self, registry):
+        with self._lock:
+            packet = ""
+            for line in self._lines(registry):
+                if packet and (len(packet) + len(line) + 1 >
+                               self.max_packet_size):
+                    self._send(packet)
+                    packet = ""
+                packet = packet + "\n" + line if packet else line
+            if packet:
+                self._send(packet)
+
+    def close(self):
+        self._socket.close()
+
+    def _lines(self, registry):
+        for metric in registry.metrics():
+            for labels, value in sorted(metric.collect().items()):
+                name = ".".join((self.prefix, metric.name.replace(
+                    "melange_client_", "", 1)) + tuple(
+                    _statsd_safe(label) for label in labels))
+                if metric.type == "gauge":
+                    yield "%s:%s|g" % (name, value)
+                elif metric.type == "counter":
+                    yield self._delta(name, value)
+                else:
+                    _counts, total, count = value
+                    yield self._delta(name + ".sum", total)
+                    yield self._delta(name + ".count", count)
+
+    def _delta(self, name, value):
+        delta = value - self._sent.get(name, 0)
+        self._sent[name] = value
+        return "%s:%s|c" % (name, delta)
+
+    def _send(self, packet):
+        try:
+            self._socket.sendto(packet, self.address)
+        except socket.error:
+            pass
+
+
+def _statsd_safe(value):
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in str(value))
@@ -0,0 +1,132 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""When and how long to wait before the transport retries a request."""
+
+from email import utils as email_utils
+import random
+import threading
+import time
+
+from melange_client import exception
+
+
+class RetryBudget(object):
+    """Caps retries to a fraction of the requests being made.
+
+    Every request deposits ratio of a token and every retry withdraws a
+    whole one, so retries can add at most that fraction of extra load to
+    a struggling server. min_per_second tokens are added over time so that
+    a client making few requests can still retry.
+
+    """
+
+    def __init__(self, ratio=0.1, min_per_second=1, max_tokens=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._refilled_at = time.time()
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._add(self.ratio)
+
+    def try_withdraw(self):
+        with self._lock:
+            now = time.time()
+            self._add((now - self._refilled_at) * self.min_per_second)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _add(self, tokens):
+        self._tokens = min(self.max_tokens, self._tokens + tokens)
+
+
+class RetryPolicy(object):
+    """Retries failed idempotent requests with exponential backoff.
+
+    Connection errors and the statuses in retry_statuses are retried up to
+    max_retries times for the methods in retry_methods. The wait before
+    retry n is drawn uniformly from [0, min(backoff_max,
+    backoff_base * 2 ** n)], unless the server asked for a delay with
+    Retry-After. A Retry-After longer than max_retry_after seconds, which
+    defaults to backoff_max, is honoured by giving up rather than by
+    retrying early.
+
+    """
+
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+    def __init__(self, max_retries=3, backoff_base=0.1, backoff_max=10,
+                 retry_methods=IDEMPOTENT_METHODS,
+                 retry_statuses=(502, 503, 504), budget=None,
+                 max_retry_after=None):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = (backoff_max if max_retry_after is None
+                                else max_retry_after)
+        self.retry_methods = retry_methods
+        self.retry_statuses = retry_statuses
+        self.budget = budget or RetryBudget()
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def delay(self, method, attempt, error):
+        """Seconds to wait before retrying, or None to give up.
+
+        attempt counts the retries already made for this request.
+
+        """
+        retry_after = parse_retry_after(
+            getattr(error, 'headers', {}).get('retry-after'))
+        if (method not in self.retry_methods
+                or attempt >= self.max_retries
+                or not self._retryable(error)
+                or (retry_after or 0) > self.max_retry_after
+                or not self.budget.try_withdraw()):
+            return None
+        with self._lock:
+            self.retries += 1
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max,
+                                     self.backoff_base * 2 ** attempt))
+
+    def _retryable(self, error):
+        if isinstance(error, exception.MelangeServiceResponseError):
+            return error.status in self.retry_statuses
+        return (isinstance(error, exception.ClientConnectionError)
+                and not isinstance(error, exception.CircuitOpenError))
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, given in either form."""
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        parsed = email_utils.parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0, email_utils.mktime_tz(parsed) - time.time())
@@ -0,0 +1,162 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Logging, and optionally profiling, of requests that take too long."""
+
+import collections
+import logging
+import sys
+import threading
+import time
+
+from melange_client import timing
+
+LOG = logging.getLogger(__name__)
+
+
+class SlowRequestLog(object):
+    """Logs every request that takes longer than threshold seconds.
+
+    Each slow request is logged as a warning whose slow_request attribute
+    holds a dict with the method, path, tenant, status, duration, phase
+    timings and retry count. With a SamplingProfiler, the Python stacks
+    sampled while the request ran past the threshold are included too.
+
+    """
+
+    def __init__(self, threshold=1.0, logger=None, profiler=None):
+        self.threshold = threshold
+        self.logger = logger or LOG
+        self.profiler = profiler
+
+    def start(self):
+        return SlowCall(self)
+
+
+class SlowCall(object):
+
+    def __init__(self, slow_log):
+        self.slow_log = slow_log
+        self.started = time.time()
+        self.thread_id = threading.current_thread().ident
+        if slow_log.profiler:
+            slow_log.profiler.watch(self.thread_id,
+                                    self.started + slow_log.threshold)
+
+    def finish(self, method, path, tenant, outcome):
+        """Logs the call if it was slow; outcome is a response or error."""
+        duration = time.time() - self.started
+        samples = None
+        if self.slow_log.profiler:
+            samples = self.slow_log.profiler.unwatch(self.thread_id)
+        if duration < self.slow_log.threshold:
+            return None
+
+        request_timing = getattr(outcome, 'timing', None)
+        record = dict(method=method,
+                      path=path,
+                      tenant=tenant,
+                      status=getattr(outcome, 'status', None),
+                      duration=duration,
+                      retries=getattr(outcome, 'retries', 0),
+                      phases=dict((phase, getattr(request_timing, phase))
+                                  for phase in timing.PHASES
+                                  if request_timing))
+        if isinstance(outcome, Exception):
+            record['error'] = repr(outcome)
+        if samples is not None:
+            record['stacks'] = [dict(count=count, stack=list(stack))
+                                for stack, count in samples.most_common(5)]
+        self.slow_log.logger.warning(
+            "Slow request: %(method)s %(path)s took %(duration).3fs "
+            "(status %(status)s, %(retries)d retries)", record,
+            extra=dict(slow_request=record))
+        return record
+
+
+class SamplingProfiler(object):
+    """Samples the stacks of threads whose request has run too long.
+
+    A daemon thread wakes every interval seconds and records the stack of
+    each watched thread that has passed its deadline, so that time spent
+    in the client itself shows up apart from time waiting on the server.
+    The thread exits once nothing is watched and is started again by the
+    next watch; close() stops it straight away.
+
+    """
+
+    def __init__(self, interval=0.01, max_depth=30):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = None
+
+    def watch(self, thread_id, deadline):
+        with self._lock:
+            self._watched[thread_id] = (deadline, collections.Counter())
+            if self._thread is None:
+                self._stopping = threading.Event()
+                self._thread = threading.Thread(target=self._run,
+                                                args=(self._stopping,))
+                self._thread.daemon = True
+                self._thread.start()
+
+    def unwatch(self, thread_id):
+        """Stops sampling thread_id; returns a Counter of sampled stacks."""
+        with self._lock:
+            _deadline, samples = self._watched.pop(thread_id,
+                                                   (None, None))
+            return samples
+
+    def close(self):
+        """Stops the sampling thread and waits for it to exit."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread:
+                self._stopping.set()
+        if thread and thread is not threading.current_thread():
+            thread.join()
+
+    def sample(self):
+        now = time.time()
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, (deadline, samples) in self._watched.items():
+                frame = frames.get(thread_id)
+                if frame is not None and now >= deadline:
+                    samples[self._stack(frame)] += 1
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append("%s:%d %s" % (code.co_filename, frame.f_lineno,
+                                       code.co_name))
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def _run(self, stopping):
+        while True:
+            stopping.wait(self.interval)
+            with self._lock:
+                if stopping.is_set() or not self._watched:
+                    if self._thread is threading.current_thread():
+                        self._thread = None
+                    return
+            self.sample()
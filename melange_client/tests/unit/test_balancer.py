@@ -0,0 +1,92 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from melange_client import balancer
+from melange_client import exception
+from melange_client import tests
+
+
+class TestBalancer(tests.BaseTest):
+
+    def _balancer(self, **kwargs):
+        return balancer.Balancer([("host1", 80), ("host2", 80)], **kwargs)
+
+    def test_prefers_endpoint_with_fewer_outstanding_requests(self):
+        lb = self._balancer(policy="least_outstanding")
+
+        first = lb.acquire()
+        second = lb.acquire()
+
+        self.assertNotEqual(first, second)
+
+    def test_power_of_two_never_picks_the_busiest_endpoint(self):
+        lb = balancer.Balancer([("host%d" % i, 80) for i in range(4)])
+        busiest = lb.endpoints[0]
+        busiest.outstanding = 100
+
+        for _i in range(50):
+            endpoint = lb.acquire()
+            self.assertFalse(endpoint is busiest)
+            lb.release(endpoint, True)
+
+    def test_skips_endpoint_whose_circuit_is_open(self):
+        lb = self._balancer(failure_threshold=2)
+        bad = lb.endpoints[0]
+
+        lb.release(lb.acquire(exclude=[lb.endpoints[1]]), False)
+        lb.release(lb.acquire(exclude=[lb.endpoints[1]]), False)
+
+        self.assertEqual(bad.breaker.state, "open")
+        for _i in range(5):
+            endpoint = lb.acquire()
+            self.assertTrue(endpoint is lb.endpoints[1])
+            lb.release(endpoint, True)
+
+    def test_recovered_endpoint_is_probed_and_brought_back(self):
+        lb = self._balancer(failure_threshold=1, reset_timeout=-1)
+        bad = lb.endpoints[0]
+        bad.outstanding += 1
+        lb.release(bad, False)
+
+        probe = lb.acquire()
+        self.assertTrue(probe is bad)
+        self.assertEqual(bad.breaker.state, "half_open")
+        lb.release(probe, True)
+
+        self.assertEqual(bad.breaker.state, "closed")
+
+    def test_fails_fast_when_every_circuit_is_open(self):
+        lb = self._balancer(failure_threshold=1)
+        for endpoint in lb.endpoints:
+            endpoint.outstanding += 1
+            lb.release(endpoint, False)
+
+        self.assertRaises(exception.CircuitOpenError, lb.acquire)
+
+    def test_stats_report_circuit_state_per_endpoint(self):
+        lb = self._balancer()
+
+        stats = lb.stats()
+
+        self.assertEqual(stats["host1:80"]['state'], "closed")
+        self.assertEqual(stats["host2:80"]['outstanding'], 0)
+
+    def test_acquire_avoids_excluded_endpoints(self):
+        lb = self._balancer()
+
+        self.assertTrue(lb.acquire(exclude=[lb.endpoints[0]]) is
+                        lb.endpoints[1])
@@ -0,0 +1,85 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from melange_client import breaker
+from melange_client import tests
+
+
+class TestCircuitBreaker(tests.BaseTest):
+
+    def test_opens_after_consecutive_failures(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=3)
+
+        circuit.record_failure()
+        circuit.record_failure()
+        self.assertEqual(circuit.state, breaker.CircuitBreaker.CLOSED)
+        circuit.record_failure()
+
+        self.assertEqual(circuit.state, breaker.CircuitBreaker.OPEN)
+        self.assertFalse(circuit.allow_request())
+        self.assertFalse(circuit.available())
+
+    def test_opens_on_high_error_rate(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=100,
+                                         error_rate=0.5,
+                                         window=4,
+                                         min_requests=4)
+
+        for _i in range(2):
+            circuit.record_success()
+            circuit.record_failure()
+
+        self.assertEqual(circuit.state, breaker.CircuitBreaker.OPEN)
+
+    def test_error_rate_needs_min_requests(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=100,
+                                         min_requests=4)
+
+        circuit.record_failure()
+
+        self.assertEqual(circuit.state, breaker.CircuitBreaker.CLOSED)
+
+    def test_half_open_lets_a_single_trial_through(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=1,
+                                         reset_timeout=-1)
+        circuit.record_failure()
+
+        self.assertTrue(circuit.allow_request())
+        self.assertEqual(circuit.state, breaker.CircuitBreaker.HALF_OPEN)
+        self.assertFalse(circuit.allow_request())
+
+    def test_successful_trial_closes_circuit(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=1,
+                                         reset_timeout=-1)
+        circuit.record_failure()
+        circuit.allow_request()
+
+        circuit.record_success()
+
+        self.assertEqual(circuit.state, breaker.CircuitBreaker.CLOSED)
+        self.assertTrue(circuit.allow_request())
+
+    def test_failed_trial_opens_circuit_again(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=1,
+                                         reset_timeout=-1)
+        circuit.record_failure()
+        circuit.allow_request()
+
+        circuit.record_failure()
+
+        self.assertEqual(circuit.state, breaker.CircuitBreaker.OPEN)
+        self.assertEqual(circuit.stats()['trips'], 2)
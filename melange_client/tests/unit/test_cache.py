@@ -0,0 +1,80 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from melange_client import cache
+from melange_client import tests
+
+
+class TestResponseCache(tests.BaseTest):
+
+    def test_get_returns_stored_value_until_it_expires(self):
+        response_cache = cache.ResponseCache(ttl=60)
+        response_cache.put("ip_block", ("/ip_blocks",), "blocks")
+
+        self.assertEqual(response_cache.get(("/ip_blocks",)).value, "blocks")
+
+        response_cache.get(("/ip_blocks",)).expires_at = time.time() - 1
+        self.assertEqual(response_cache.get(("/ip_blocks",)), None)
+        self.assertEqual(response_cache.stats()['hits'], 2)
+        self.assertEqual(response_cache.stats()['misses'], 1)
+
+    def test_ttl_can_be_set_per_resource_name(self):
+        response_cache = cache.ResponseCache(ttl=60, ttls={'ip_address': 0})
+
+        response_cache.put("ip_address", ("/ip_addresses",), "addresses")
+
+        self.assertEqual(response_cache.ttl_for("ip_block"), 60)
+        self.assertEqual(response_cache.get(("/ip_addresses",)), None)
+
+    def test_evicts_least_recently_used_entry(self):
+        response_cache = cache.ResponseCache(max_entries=2)
+        response_cache.put("ip_block", ("/a",), "a")
+        response_cache.put("ip_block", ("/b",), "b")
+        response_cache.get(("/a",))
+
+        response_cache.put("ip_block", ("/c",), "c")
+
+        self.assertEqual(response_cache.get(("/b",)), None)
+        self.assertEqual(response_cache.get(("/a",)).value, "a")
+        self.assertEqual(response_cache.stats()['evictions'], 1)
+
+    def test_invalidate_drops_path_and_paths_below_it(self):
+        response_cache = cache.ResponseCache()
+        for path in ("/ip_blocks", "/ip_blocks/1", "/ip_blocks_other"):
+            response_cache.put("ip_block", (path,), path)
+
+        response_cache.invalidate("/ip_blocks")
+
+        self.assertEqual(response_cache.get(("/ip_blocks",)), None)
+        self.assertEqual(response_cache.get(("/ip_blocks/1",)), None)
+        self.assertEqual(response_cache.get(("/ip_blocks_other",)).value,
+                         "/ip_blocks_other")
+
+    def test_refresh_restarts_ttl_of_expired_entry(self):
+        response_cache = cache.ResponseCache(ttl=60)
+        response_cache.put("ip_block", ("/a",), "a", etag='"v1"')
+        response_cache.get(("/a",)).expires_at = time.time() - 1
+        self.assertEqual(response_cache.get(("/a",)), None)
+
+        self.assertEqual(response_cache.validators(("/a",)),
+                         {'If-None-Match': '"v1"'})
+        response_cache.refresh("ip_block", ("/a",))
+
+        self.assertEqual(response_cache.get(("/a",)).value, "a")
+        self.assertEqual(response_cache.refresh("ip_block", ("/b",)), None)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import imp
+import json
+import optparse
+import random
+import StringIO
+import sys
+import tempfile
+import time
+
+import melange_client
+from melange_client import exception
+from melange_client import tests
+from melange_client import timing
+
+cli = imp.load_source("melange_cli",
+                      melange_client.melange_bin_path("melange"))
+
+
+class FakeIpBlockClient(object):
+
+    TENANT_ID_REQUIRED = True
+
+    def __init__(self, timing_summary=None):
+        self._timing_summary = timing_summary
+
+    def show(self, id):
+        time.sleep(random.random() * 0.01)
+        if self._timing_summary:
+            self._timing_summary(timing.RequestTiming("GET", "/" + id, "h:1"))
+        return {'ip_block': {'id': id}}
+
+    def list(self):
+        return (block for block in [{'id': "1"}, {'id': "2"}])
+
+    def delete(self, id):
+        raise exception.MelangeServiceResponseError("not found", 404)
+
+
+class FakeFactory(object):
+
+    def __init__(self, timing_summary=None):
+        self.ip_block = FakeIpBlockClient(timing_summary)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class CLITest(tests.BaseTest):
+
+    def setUp(self):
+        super(CLITest, self).setUp()
+        self.stdout = StringIO.StringIO()
+        self.mock.stubs.Set(sys, "stdout", self.stdout)
+
+    def tearDown(self):
+        self.mock.UnsetStubs()
+        super(CLITest, self).tearDown()
+
+    def options(self, *args):
+        parser = optparse.OptionParser()
+        cli.create_options(parser)
+        options, _args = parser.parse_args(["-t", "tenant"] + list(args))
+        return options
+
+    def batch_file(self, *commands):
+        batch_file = tempfile.NamedTemporaryFile(suffix=".batch")
+        batch_file.write("\n".join(commands) + "\n")
+        batch_file.flush()
+        self.addCleanup(batch_file.close)
+        return batch_file.name
+
+    def printed(self):
+        return [json.loads(line)
+                for line in self.stdout.getvalue().splitlines()]
+
+
+class TestRunCommand(CLITest):
+
+    def test_successful_command(self):
+        result = cli.run_command(FakeFactory(), self.options(),
+                                 "ip_block show id=1")
+
+        self.assertEqual(result, dict(command="ip_block show id=1", ok=True,
+                                      result={'ip_block': {'id': "1"}}))
+
+    def test_generators_are_turned_into_lists(self):
+        result = cli.run_command(FakeFactory(), self.options(),
+                                 "ip_block list")
+
+        self.assertEqual(result['result'], [{'id': "1"}, {'id': "2"}])
+
+    def test_server_error_carries_status(self):
+        result = cli.run_command(FakeFactory(), self.options(),
+                                 "ip_block delete id=1")
+
+        self.assertFalse(result['ok'])
+        self.assertEqual(result['status'], 404)
+
+    def test_malformed_commands_are_reported(self):
+        options = self.options()
+
+        for command, error in [("ip_block", "should be of the form"),
+                               ("foo show", "Unknown category foo"),
+                               ("ip_block bar", "Unknown action bar"),
+                               ("ip_block show id", "field=value"),
+                               ("ip_block show", "wrong number")]:
+            result = cli.run_command(FakeFactory(), options, command)
+            self.assertFalse(result['ok'])
+            self.assertIn(error, result['error'])
+
+    def test_tenant_is_required_for_tenant_resources(self):
+        options = self.options()
+        options.tenant = None
+
+        result = cli.run_command(FakeFactory(), options, "ip_block show id=1")
+
+        self.assertIn("tenant id", result['error'])
+
+
+class TestRunBatch(CLITest):
+
+    def test_prints_one_json_result_per_command(self):
+        options = self.options("--batch", self.batch_file(
+            "# comment", "ip_block show id=1", "", "ip_block delete id=2"))
+
+        self.assertFalse(cli.run_batch(FakeFactory(), options))
+
+        shown, deleted = self.printed()
+        self.assertEqual((shown['line'], shown['ok']), (2, True))
+        self.assertEqual((deleted['line'], deleted['ok'],
+                          deleted['status']), (4, False, 404))
+
+    def test_succeeds_when_every_command_does(self):
+        options = self.options("--batch", self.batch_file(
+            "ip_block show id=1", "ip_block list"))
+
+        self.assertTrue(cli.run_batch(FakeFactory(), options))
+
+    def test_parallel_results_are_printed_in_input_order(self):
+        ids = [str(i) for i in range(40)]
+        options = self.options("--parallel", "8", "--batch", self.batch_file(
+            *["ip_block show id=%s" % id for id in ids]))
+
+        self.assertTrue(cli.run_batch(FakeFactory(), options))
+
+        self.assertEqual([result['result']['ip_block']['id']
+                          for result in self.printed()], ids)
+
+    def test_parallel_workers_share_timing_summary(self):
+        summary = timing.TimingSummary()
+        options = self.options("--parallel", "8", "--batch", self.batch_file(
+            *["ip_block show id=%d" % i for i in range(100)]))
+
+        cli.run_batch(FakeFactory(summary), options)
+
+        self.assertEqual(sorted(t.url for t in summary.timings),
+                         sorted("/%d" % i for i in range(100)))
+        self.assertIn("100 requests", "\n".join(summary.report()))
+
+    def test_main_exits_with_1_when_a_command_fails(self):
+        factory = FakeFactory()
+        self.mock.stubs.Set(cli, "create_factory",
+                            lambda options, timing_hooks: factory)
+        self.mock.stubs.Set(sys, "argv", [
+            "melange", "-t", "tenant", "--batch",
+            self.batch_file("ip_block show id=1", "ip_block delete id=1")])
+
+        try:
+            cli.main()
+            self.fail("main did not exit")
+        except SystemExit as exit:
+            self.assertEqual(exit.code, 1)
+        self.assertTrue(factory.closed)
+
+
+class InterruptedInput(object):
+    """Shell input whose first line is interrupted with Ctrl-C."""
+
+    def __init__(self, *lines):
+        self.lines = list(lines)
+        self.interrupted = False
+
+    def readline(self):
+        if not self.interrupted:
+            self.interrupted = True
+            raise KeyboardInterrupt()
+        return self.lines.pop(0) if self.lines else ""
+
+
+class TestShell(CLITest):
+
+    def setUp(self):
+        super(TestShell, self).setUp()
+        self.summary = timing.TimingSummary()
+        self.shell = cli.Shell(FakeFactory(self.summary), self.options(),
+                               self.summary)
+        history = tempfile.NamedTemporaryFile(suffix=".history")
+        self.addCleanup(history.close)
+        self.shell.history_file = history.name
+
+    def test_completes_categories(self):
+        self.assertEqual(self.shell.completenames("ip_b"), ["ip_block "])
+        self.assertEqual(self.shell.completenames("ex"), ["exit "])
+
+    def test_completes_actions_of_a_category(self):
+        self.assertEqual(sorted(self.shell.completedefault(
+            "", "ip_block ", 9, 9)), ["delete ", "list ", "show "])
+        self.assertEqual(self.shell.completedefault("sh", "ip_block sh",
+                                                    9, 11), ["show "])
+        self.assertEqual(self.shell.completedefault("", "foo ", 4, 4), [])
+
+    def test_completes_parameters_of_an_action(self):
+        self.assertEqual(self.shell.completedefault(
+            "", "ip_block show ", 14, 14), ["id="])
+        self.assertEqual(self.shell.completedefault(
+            "", "ip_block bar ", 13, 13), [])
+
+    def test_commands_are_run_and_timed(self):
+        self.shell.onecmd("ip_block show id=7")
+
+        output = self.stdout.getvalue()
+        self.assertIn("id: '7'", output)
+        self.assertIn("1 request(s)", output)
+
+    def test_timings_are_reset_for_every_command(self):
+        self.shell.onecmd("ip_block show id=1")
+        self.shell.onecmd("ip_block show id=2")
+
+        self.assertEqual([t.url for t in self.summary.timings], ["/2"])
+
+    def test_errors_are_printed_and_shell_keeps_going(self):
+        self.shell.onecmd("ip_block delete id=1")
+        self.shell.onecmd("ip_block bar")
+
+        output = self.stdout.getvalue()
+        self.assertIn("The server returned an error", output)
+        self.assertIn("Unknown action bar", output)
+
+    def test_ctrl_c_abandons_line_and_prompts_again(self):
+        self.shell.use_rawinput = False
+        self.shell.stdin = InterruptedInput("ip_block show id=3\n", "exit\n")
+
+        self.shell.cmdloop()
+
+        output = self.stdout.getvalue()
+        self.assertIn("^C", output)
+        self.assertIn("id: '3'", output)
+        self.assertEqual(output.count("Melange shell"), 1)
@@ -16,14 +16,31 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import errno
+import httplib
 import json
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import time
 import urlparse
+import zlib
 
 import httplib2
 import mox
 
 from melange_client import client
+from melange_client import compression
+from melange_client import exception
+from melange_client import executor
+from melange_client import hedge
+from melange_client import limiter
+from melange_client import retry
 from melange_client import tests
+from melange_client import tracing
 
 
 class TestAuthorizationClient(tests.BaseTest):
@@ -63,6 +80,60 @@ class TestAuthorizationClient(tests.BaseTest):
         self.mock.ReplayAll()
         self.assertEqual(auth_client.get_token(), "auth_token")
 
+    def test_get_token_reuses_cached_token_until_it_expires(self):
+        url = "http://localhost:5001"
+        auth_client = client.AuthorizationClient(url,
+                                                 "username",
+                                                 "access_key")
+        self.mock.StubOutWithMock(auth_client, "request")
+        response_body = json.dumps({'auth': {'token': {
+            'id': "auth_token",
+            'expires': "2999-01-01T00:00:00"}}})
+        res = httplib2.Response(dict(status='200'))
+        auth_client.request(urlparse.urljoin(url, "/v2.0/tokens"),
+                            "POST",
+                            headers=mox.IgnoreArg(),
+                            body=mox.IgnoreArg()).AndReturn((res,
+                                                             response_body))
+
+        self.mock.ReplayAll()
+        self.assertEqual(auth_client.get_token(), "auth_token")
+        self.assertEqual(auth_client.get_token(), "auth_token")
+        self.mock.VerifyAll()
+
+    def test_token_with_unparseable_expiry_is_cached_for_default_ttl(self):
+        url = "http://localhost:5001"
+        token_cache = client.TokenCache(default_ttl=600)
+        auth_client = client.AuthorizationClient(url,
+                                                 "username",
+                                                 "access_key",
+                                                 token_cache=token_cache)
+        self.mock.StubOutWithMock(auth_client, "request")
+        response_body = json.dumps({'auth': {'token': {
+            'id': "auth_token",
+            'expires': "Tue, 01 Jan 2999 00:00:00 GMT"}}})
+        res = httplib2.Response(dict(status='200'))
+        auth_client.request(urlparse.urljoin(url, "/v2.0/tokens"),
+                            "POST",
+                            headers=mox.IgnoreArg(),
+                            body=mox.IgnoreArg()).AndReturn((res,
+                                                             response_body))
+
+        self.mock.ReplayAll()
+        self.assertEqual(auth_client.get_token(), "auth_token")
+        self.assertEqual(auth_client.get_token(), "auth_token")
+        self.assertTrue(token_cache._expires_at <= time.time() + 600)
+        self.mock.VerifyAll()
+
+    def test_invalidate_token_does_not_drop_given_token(self):
+        auth_client = client.AuthorizationClient("http://localhost:5001",
+                                                 "username",
+                                                 "access_key",
+                                                 "auth_token")
+
+        self.assertFalse(auth_client.invalidate_token())
+        self.assertEqual(auth_client.get_token(), "auth_token")
+
     def test_raises_error_when_retreiveing_token_fails(self):
         url = "http://localhost:5001"
         auth_client = client.AuthorizationClient(url,
@@ -84,3 +155,763 @@ class TestAuthorizationClient(tests.BaseTest):
         self.assertRaisesExcMessage(Exception,
                                     expected_error_msg,
                                     auth_client.get_token)
+
+
+class FakeConnection(object):
+
+    def __init__(self, responses=None):
+        self.sock, self._peer = socket.socketpair()
+        self.responses = list(responses or [])
+        self.requests = []
+        self.sent = []
+        self.closed = False
+
+    def request(self, method, url, body, headers):
+        self.requests.append((method, url))
+        self.sent.append((body, headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        self._response = response
+
+    def getresponse(self):
+        return self._response
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        self._peer.close()
+
+
+class FakeResponse(object):
+
+    def __init__(self, status=200, body="", will_close=False, headers=None):
+        self.status = status
+        self.reason = "OK"
+        self.will_close = will_close
+        self._body = body
+        self._headers = headers or {}
+
+    def getheaders(self):
+        return [('content-type', "application/json")] + self._headers.items()
+
+    def read(self, amt=None):
+        amt = len(self._body) if amt is None else amt
+        data, self._body = self._body[:amt], self._body[amt:]
+        return data
+
+    def isclosed(self):
+        return not self._body
+
+
+class TestConnectionPool(tests.BaseTest):
+
+    def test_reuses_released_connection(self):
+        pool = client.ConnectionPool()
+        connection = FakeConnection()
+
+        first, first_reused = pool.acquire("key", lambda: connection)
+        pool.release("key", first)
+        second, second_reused = pool.acquire("key", FakeConnection)
+
+        self.assertTrue(second is connection)
+        self.assertFalse(first_reused)
+        self.assertTrue(second_reused)
+        self.assertEqual(pool.stats()['hits'], 1)
+        self.assertEqual(pool.stats()['misses'], 1)
+
+    def test_connections_are_pooled_per_key(self):
+        pool = client.ConnectionPool()
+        connection, _reused = pool.acquire("key1", FakeConnection)
+        pool.release("key1", connection)
+
+        other, reused = pool.acquire("key2", FakeConnection)
+
+        self.assertFalse(reused)
+        self.assertFalse(other is connection)
+
+    def test_evicts_connections_beyond_max_size(self):
+        pool = client.ConnectionPool(max_size=1)
+        first, _reused = pool.acquire("key", FakeConnection)
+        second, _reused = pool.acquire("key", FakeConnection)
+
+        pool.release("key", first)
+        pool.release("key", second)
+
+        self.assertTrue(second.closed)
+        self.assertEqual(pool.stats()['evictions'], 1)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_evicts_connections_idle_for_too_long(self):
+        pool = client.ConnectionPool(max_idle=-1)
+        connection, _reused = pool.acquire("key", FakeConnection)
+        pool.release("key", connection)
+
+        new_connection, reused = pool.acquire("key", FakeConnection)
+
+        self.assertFalse(reused)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['evictions'], 1)
+
+    def test_evicts_connections_older_than_max_lifetime(self):
+        pool = client.ConnectionPool(max_lifetime=-1)
+        connection, _reused = pool.acquire("key", FakeConnection)
+        pool.release("key", connection)
+
+        new_connection, reused = pool.acquire("key", FakeConnection)
+
+        self.assertFalse(reused)
+        self.assertTrue(connection.closed)
+
+    def test_evicts_connections_closed_by_server(self):
+        pool = client.ConnectionPool()
+        connection, _reused = pool.acquire("key", FakeConnection)
+        pool.release("key", connection)
+        connection._peer.close()
+
+        new_connection, reused = pool.acquire("key", FakeConnection)
+
+        self.assertFalse(reused)
+        self.assertTrue(connection.closed)
+
+    def test_close_closes_idle_connections(self):
+        pool = client.ConnectionPool()
+        connection, _reused = pool.acquire("key", FakeConnection)
+        pool.release("key", connection)
+
+        pool.close()
+
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['idle'], 0)
+
+
+class TestHTTPClient(tests.BaseTest):
+
+    def test_do_request_reuses_keep_alive_connection(self):
+        connection = FakeConnection([FakeResponse(body="first"),
+                                     FakeResponse(body="second")])
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+
+        self.assertEqual(http_client.do_request("GET", "/a").read(), "first")
+        self.assertEqual(http_client.do_request("GET", "/b").read(), "second")
+        self.assertEqual(http_client.pool.stats()['hits'], 1)
+        self.mock.VerifyAll()
+
+    def test_do_request_does_not_pool_connections_marked_close(self):
+        connection = FakeConnection([FakeResponse(will_close=True)])
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+
+        http_client.do_request("GET", "/a")
+
+        self.assertTrue(connection.closed)
+        self.assertEqual(http_client.pool.stats()['idle'], 0)
+
+    def test_do_request_retries_once_on_stale_pooled_connection(self):
+        stale = FakeConnection([FakeResponse(),
+                                httplib.BadStatusLine("")])
+        fresh = FakeConnection([FakeResponse(body="fresh")])
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(stale)
+        http_client._get_connection("localhost", 8080).AndReturn(fresh)
+        self.mock.ReplayAll()
+
+        http_client.do_request("GET", "/a")
+        response = http_client.do_request("GET", "/a")
+
+        self.assertEqual(response.read(), "fresh")
+        self.assertTrue(stale.closed)
+        self.mock.VerifyAll()
+
+    def test_do_request_does_not_resend_post_on_stale_connection(self):
+        stale = FakeConnection([FakeResponse(),
+                                httplib.BadStatusLine("")])
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(stale)
+        self.mock.ReplayAll()
+
+        http_client.do_request("GET", "/a")
+
+        self.assertRaises(exception.ClientConnectionError,
+                          http_client.do_request, "POST", "/a", body="{}")
+        self.assertEqual(stale.requests, [("GET", "/a?"), ("POST", "/a?")])
+        self.mock.VerifyAll()
+
+    def test_do_request_resends_post_not_yet_sent_on_stale_connection(self):
+        stale = FakeConnection([FakeResponse(),
+                                httplib.CannotSendRequest()])
+        fresh = FakeConnection([FakeResponse(body="created")])
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(stale)
+        http_client._get_connection("localhost", 8080).AndReturn(fresh)
+        self.mock.ReplayAll()
+
+        http_client.do_request("GET", "/a")
+        response = http_client.do_request("POST", "/a", body="{}")
+
+        self.assertEqual(response.read(), "created")
+        self.mock.VerifyAll()
+
+    def test_do_request_resends_get_on_reset_pooled_connection(self):
+        stale = FakeConnection([FakeResponse(),
+                                socket.error(errno.ECONNRESET, "reset")])
+        fresh = FakeConnection([FakeResponse(body="fresh")])
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(stale)
+        http_client._get_connection("localhost", 8080).AndReturn(fresh)
+        self.mock.ReplayAll()
+
+        http_client.do_request("GET", "/a")
+        response = http_client.do_request("GET", "/a")
+
+        self.assertEqual(response.read(), "fresh")
+        self.mock.VerifyAll()
+
+    def test_do_request_does_not_resend_get_timed_out_on_pooled_connection(
+            self):
+        connection = FakeConnection([FakeResponse(),
+                                     socket.timeout("timed out")])
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+
+        http_client.do_request("GET", "/a")
+
+        self.assertRaises(exception.ClientConnectionError,
+                          http_client.do_request, "GET", "/a")
+        self.assertEqual(connection.requests, [("GET", "/a?"),
+                                               ("GET", "/a?")])
+        self.mock.VerifyAll()
+
+    def test_do_request_does_not_retry_failures_on_new_connections(self):
+        connection = FakeConnection([socket.error("connection refused")])
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+
+        self.assertRaises(exception.ClientConnectionError,
+                          http_client.do_request, "GET", "/a")
+        self.mock.VerifyAll()
+
+    def test_do_request_raises_error_for_failed_response(self):
+        connection = FakeConnection([FakeResponse(status=404,
+                                                  body="not found")])
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+
+        self.assertRaisesExcMessage(exception.MelangeServiceResponseError,
+                                    "not found",
+                                    http_client.do_request, "GET", "/a")
+        self.assertEqual(http_client.pool.stats()['idle'], 1)
+
+    def test_do_request_retries_failures_allowed_by_retry_policy(self):
+        connection = FakeConnection([FakeResponse(status=503),
+                                     FakeResponse(body="ok")])
+        http_client = client.HTTPClient(
+            retry_policy=retry.RetryPolicy(backoff_max=0))
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+
+        self.assertEqual(http_client.do_request("GET", "/a").read(), "ok")
+        self.assertEqual(http_client.retry_policy.retries, 1)
+
+    def test_retry_after_connection_error_goes_to_another_endpoint(self):
+        http_client = client.HTTPClient(
+            endpoints=[("down", 80), ("up", 80)],
+            retry_policy=retry.RetryPolicy(backoff_max=0))
+        down, up = http_client.balancer.endpoints
+        down.outstanding = -100
+        attempts = []
+
+        def exchange(endpoint, *request):
+            attempts.append(endpoint)
+            if endpoint is down:
+                raise exception.ClientConnectionError("connection refused")
+            return client.Response(FakeResponse(body="ok"), "ok")
+
+        self.mock.stubs.Set(http_client, "_exchange", exchange)
+
+        self.assertEqual(http_client.do_request("GET", "/a").read(), "ok")
+        self.assertEqual(attempts, [down, up])
+
+    def test_do_request_does_not_retry_without_retry_policy(self):
+        connection = FakeConnection([FakeResponse(status=503)])
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+
+        self.assertRaises(exception.MelangeServiceResponseError,
+                          http_client.do_request, "GET", "/a")
+
+    def test_do_request_fails_fast_while_circuit_is_open(self):
+        connection = FakeConnection([socket.error("timed out")])
+        http_client = client.HTTPClient(
+            breaker_options=dict(failure_threshold=1))
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+
+        self.assertRaises(exception.ClientConnectionError,
+                          http_client.do_request, "GET", "/a")
+        self.assertRaises(exception.CircuitOpenError,
+                          http_client.do_request, "GET", "/a")
+        self.assertEqual(http_client.circuit_states(),
+                         {"localhost:8080": "open"})
+        self.mock.VerifyAll()
+
+    def test_slow_get_is_hedged_to_another_endpoint(self):
+        http_client = client.HTTPClient(
+            endpoints=[("slow", 80), ("fast", 80)],
+            hedge_policy=hedge.HedgePolicy(max_delay=0.01))
+        slow_endpoint, fast_endpoint = http_client.balancer.endpoints
+        slow_endpoint.outstanding = -100
+        release_slow = threading.Event()
+
+        def exchange(endpoint, *request):
+            if endpoint is slow_endpoint:
+                release_slow.wait(5)
+                return client.Response(FakeResponse(body="slow"), "slow")
+            return client.Response(FakeResponse(body="fast"), "fast")
+
+        self.mock.stubs.Set(http_client, "_exchange", exchange)
+
+        response = http_client.do_request("GET", "/a")
+        release_slow.set()
+
+        self.assertEqual(response.read(), "fast")
+        self.assertEqual(http_client.hedge_policy.stats()['hedge_wins'], 1)
+        http_client.close()
+
+    def test_hedged_gets_leave_no_endpoint_outstanding(self):
+        http_client = client.HTTPClient(
+            endpoints=[("slow", 80), ("fast", 80)],
+            hedge_policy=hedge.HedgePolicy(max_delay=0.01))
+        slow_endpoint, fast_endpoint = http_client.balancer.endpoints
+        release_slow = threading.Event()
+
+        def exchange(endpoint, *request):
+            if endpoint is slow_endpoint:
+                release_slow.wait(5)
+            return client.Response(FakeResponse(), repr(endpoint))
+
+        self.mock.stubs.Set(http_client, "_exchange", exchange)
+        self.mock.stubs.Set(http_client.balancer, "_pick",
+                            lambda candidates: candidates[0])
+
+        primaries = []
+
+        def spawn(fn, *args):
+            primaries.append(real_spawn(fn, *args))
+            return primaries[-1]
+
+        real_spawn = executor.spawn
+        self.mock.stubs.Set(executor, "spawn", spawn)
+        self.addCleanup(self.mock.UnsetStubs)
+
+        for _i in range(3):
+            self.assertEqual(http_client.do_request("GET", "/a").read(),
+                             "fast:80")
+        release_slow.set()
+        for primary in primaries:
+            primary.exception(timeout=5)
+        http_client._hedge_executor.shutdown()
+
+        self.assertEqual(slow_endpoint.outstanding, 0)
+        self.assertEqual(fast_endpoint.outstanding, 0)
+
+    def test_hedge_cancelled_before_it_starts_hands_back_endpoint(self):
+        http_client = client.HTTPClient(
+            endpoints=[("primary", 80), ("hedge", 80)],
+            hedge_policy=hedge.HedgePolicy(max_delay=0.01))
+        primary, hedge_endpoint = http_client.balancer.endpoints
+        hedge_endpoint.breaker.state = hedge_endpoint.breaker.HALF_OPEN
+        hedge_endpoint.breaker.opened_at = time.time() + 60
+        pool = executor.Executor(max_workers=1)
+        queued_hedge = executor.Future()
+
+        def submit(fn, *args):
+            return queued_hedge
+
+        def exchange(endpoint, *request):
+            time.sleep(0.05)
+            return client.Response(FakeResponse(), repr(endpoint))
+
+        self.mock.stubs.Set(pool, "submit", submit)
+        self.mock.stubs.Set(http_client, "_hedge_pool", lambda: pool)
+        self.mock.stubs.Set(http_client, "_exchange", exchange)
+        self.mock.stubs.Set(http_client.balancer, "_pick",
+                            lambda candidates: candidates[0])
+
+        self.assertEqual(http_client.do_request("GET", "/a").read(),
+                         "primary:80")
+        pool.shutdown()
+
+        self.assertTrue(queued_hedge.cancelled())
+        self.assertEqual(hedge_endpoint.outstanding, 0)
+        self.assertTrue(hedge_endpoint.breaker.available())
+
+    def test_hedged_gets_do_not_wait_for_each_other(self):
+        http_client = client.HTTPClient(
+            endpoints=[("host1", 80), ("host2", 80)],
+            hedge_policy=hedge.HedgePolicy(max_delay=5))
+        concurrency = http_client.pool.max_size * 3
+        in_flight = []
+        all_in_flight = threading.Event()
+
+        def exchange(endpoint, *request):
+            in_flight.append(endpoint)
+            if len(in_flight) == concurrency:
+                all_in_flight.set()
+            all_in_flight.wait(5)
+            return client.Response(FakeResponse(), repr(endpoint))
+
+        self.mock.stubs.Set(http_client, "_exchange", exchange)
+        callers = [threading.Thread(target=http_client.do_request,
+                                    args=("GET", "/a"))
+                   for _i in range(concurrency)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join(10)
+
+        self.assertTrue(all_in_flight.is_set())
+        self.assertEqual(http_client.hedge_policy.stats()['hedges'], 0)
+        http_client.close()
+
+    def test_hedging_client_can_be_used_after_close(self):
+        http_client = client.HTTPClient(
+            endpoints=[("host1", 80), ("host2", 80)],
+            hedge_policy=hedge.HedgePolicy(max_delay=0.01))
+        self.mock.stubs.Set(http_client, "_exchange", lambda *args:
+                            client.Response(FakeResponse(), "ok"))
+
+        http_client.do_request("GET", "/a")
+        http_client.close()
+
+        self.assertEqual(http_client.do_request("GET", "/a").read(), "ok")
+        http_client.close()
+
+    def test_writes_are_never_hedged(self):
+        http_client = client.HTTPClient(
+            endpoints=[("host1", 80), ("host2", 80)],
+            hedge_policy=hedge.HedgePolicy(max_delay=0))
+        requests = []
+
+        def exchange(endpoint, *request):
+            requests.append(endpoint)
+            return client.Response(FakeResponse(), "")
+
+        self.mock.stubs.Set(http_client, "_exchange", exchange)
+
+        http_client.do_request("POST", "/a")
+
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(http_client.hedge_policy.stats()['hedges'], 0)
+        http_client.close()
+
+    def test_do_request_is_rate_limited_per_endpoint_and_tenant(self):
+        rate_limiter = self.mock.CreateMock(limiter.RateLimiter)
+        rate_limiter.acquire("localhost:8080", "tenant1")
+        connection = FakeConnection([FakeResponse()])
+        http_client = client.HTTPClient(rate_limiter=rate_limiter)
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+
+        http_client.do_request("GET", "/v0.1/ipam/tenants/tenant1/ip_blocks")
+
+        self.mock.VerifyAll()
+
+    def test_overloaded_server_shrinks_concurrency_limit(self):
+        concurrency_limit = limiter.AdaptiveConcurrencyLimit(initial_limit=4)
+        connection = FakeConnection([FakeResponse(status=503)])
+        http_client = client.HTTPClient(concurrency_limit=concurrency_limit)
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+
+        self.assertRaises(exception.MelangeServiceResponseError,
+                          http_client.do_request, "GET", "/a")
+        self.assertTrue(concurrency_limit.limit < 4)
+        self.assertEqual(concurrency_limit.inflight, 0)
+
+    def _streaming_client(self, connection):
+        http_client = client.HTTPClient()
+        self.mock.StubOutWithMock(http_client, "_get_connection")
+        http_client._get_connection("localhost", 8080).AndReturn(connection)
+        self.mock.ReplayAll()
+        return http_client
+
+    def test_streamed_connection_is_pooled_once_body_is_read(self):
+        connection = FakeConnection([FakeResponse(body="0123456789")])
+        http_client = self._streaming_client(connection)
+
+        response = http_client.do_request("GET", "/a", stream=True)
+
+        self.assertEqual(http_client.pool.stats()['in_use'], 1)
+        self.assertEqual(list(response.iter_chunks(4)),
+                         ["0123", "4567", "89"])
+        self.assertEqual(http_client.pool.stats()['in_use'], 0)
+        self.assertEqual(http_client.pool.stats()['idle'], 1)
+
+    def test_streamed_connection_is_closed_when_body_is_not_read(self):
+        connection = FakeConnection([FakeResponse(body="0123456789")])
+        http_client = self._streaming_client(connection)
+
+        response = http_client.do_request("GET", "/a", stream=True)
+        response.read(4)
+        response.close()
+
+        self.assertTrue(connection.closed)
+        self.assertEqual(http_client.pool.stats()['in_use'], 0)
+        self.assertEqual(http_client.pool.stats()['idle'], 0)
+
+    def test_gzipped_response_is_decoded_and_counted(self):
+        body = json.dumps({'ip_addresses': [{'id': i} for i in range(100)]})
+        connection = FakeConnection([FakeResponse(
+            body=compression.gzip(body),
+            headers={'content-encoding': "gzip"})])
+        http_client = self._streaming_client(connection)
+
+        self.assertEqual(http_client.do_request("GET", "/a").read(), body)
+        self.assertEqual(connection.sent[0][1]['Accept-Encoding'],
+                         "gzip, deflate")
+        stats = http_client.transfer.stats()
+        self.assertEqual(stats['bytes_received'],
+                         len(compression.gzip(body)))
+        self.assertEqual(stats['bytes_decoded'], len(body))
+
+    def test_streamed_gzipped_response_is_decoded_as_it_is_read(self):
+        body = "".join(str(i) for i in range(1000))
+        connection = FakeConnection([FakeResponse(
+            body=compression.gzip(body),
+            headers={'content-encoding': "gzip"})])
+        http_client = self._streaming_client(connection)
+
+        response = http_client.do_request("GET", "/a", stream=True)
+
+        self.assertEqual("".join(response.iter_chunks(16)), body)
+        self.assertEqual(http_client.pool.stats()['idle'], 1)
+
+    def test_large_request_bodies_are_gzipped(self):
+        connection = FakeConnection([FakeResponse(), FakeResponse()])
+        http_client = self._streaming_client(connection)
+        http_client.compress_min_size = 100
+
+        http_client.do_request("POST", "/a", body="x" * 100)
+        http_client.do_request("POST", "/a", body="x" * 99)
+
+        (large, large_headers), (small, small_headers) = connection.sent
+        self.assertEqual(large_headers['Content-Encoding'], "gzip")
+        self.assertEqual(zlib.decompress(large, 16 + zlib.MAX_WBITS),
+                         "x" * 100)
+        self.assertEqual(small, "x" * 99)
+        self.assertFalse('Content-Encoding' in small_headers)
+        self.assertEqual(http_client.transfer.stats()['bytes_sent'],
+                         len(large) + 99)
+
+    def test_timing_hooks_get_phase_breakdown_of_each_request(self):
+        timings = []
+        connection = FakeConnection([FakeResponse(body="response")])
+        http_client = self._streaming_client(connection)
+        http_client.add_timing_hook(timings.append)
+
+        http_client.do_request("POST", "/a", body="request")
+
+        self.assertEqual(len(timings), 1)
+        self.assertEqual(timings[0].method, "POST")
+        self.assertEqual(timings[0].status, 200)
+        self.assertEqual(timings[0].bytes_sent, len("request"))
+        self.assertEqual(timings[0].bytes_received, len("response"))
+        self.assertTrue(timings[0].total >= timings[0].wait >= 0)
+
+    def test_streamed_request_timing_is_reported_once_body_is_read(self):
+        timings = []
+        connection = FakeConnection([FakeResponse(body="0123456789")])
+        http_client = self._streaming_client(connection)
+        http_client.add_timing_hook(timings.append)
+
+        response = http_client.do_request("GET", "/a", stream=True)
+        self.assertEqual(timings, [])
+        list(response.iter_chunks(4))
+
+        self.assertEqual(timings, [response.timing])
+        self.assertEqual(timings[0].bytes_received, 10)
+
+    def test_traced_request_propagates_trace_context(self):
+        connection = FakeConnection([FakeResponse(body="ok")])
+        http_client = self._streaming_client(connection)
+        http_client.tracer = tracing.Tracer()
+
+        http_client.do_request("GET", "/a")
+
+        spans = http_client.tracer.exporter.spans
+        http_span = spans[-1]
+        self.assertEqual(http_span.name, "http")
+        self.assertEqual(http_span.attributes['status'], 200)
+        self.assertEqual([span.name for span in spans[:-1]],
+                         ["send", "wait", "transfer"])
+        self.assertTrue(connection.sent[0][1]['traceparent'].endswith(
+            "-%s-01" % http_span.span_id))
+
+
+class TestTimedHTTPConnection(tests.BaseTest):
+
+    def test_records_dns_and_connect_time(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        connection = client.TimedHTTPConnection("localhost",
+                                                server.getsockname()[1],
+                                                timeout=5)
+
+        connection.connect()
+
+        self.assertEqual(sorted(connection.connect_timings),
+                         ["connect", "dns"])
+        connection.close()
+        server.close()
+
+
+class TestTokenCache(tests.BaseTest):
+
+    def test_get_caches_token_until_refresh_is_due(self):
+        cache = client.TokenCache(refresh_margin=60)
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            return "token", time.time() + 3600
+
+        self.assertEqual(cache.get(fetch), "token")
+        self.assertEqual(cache.get(fetch), "token")
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_get_refreshes_token_ahead_of_expiry(self):
+        cache = client.TokenCache(refresh_margin=60)
+        tokens = iter([("old", time.time() + 30), ("new", time.time() + 3600)])
+
+        self.assertEqual(cache.get(tokens.next), "old")
+        self.assertEqual(cache.get(tokens.next), "new")
+
+    def test_get_uses_default_ttl_when_token_has_no_expiry(self):
+        cache = client.TokenCache(refresh_margin=0, default_ttl=3600)
+        tokens = iter([("token", None), ("other", None)])
+
+        cache.get(tokens.next)
+
+        self.assertEqual(cache.get(tokens.next), "token")
+
+    def test_invalidate_forces_a_new_fetch(self):
+        cache = client.TokenCache()
+        tokens = iter([("old", time.time() + 3600),
+                       ("new", time.time() + 3600)])
+        cache.get(tokens.next)
+
+        cache.invalidate()
+
+        self.assertEqual(cache.get(tokens.next), "new")
+
+    def test_concurrent_callers_trigger_a_single_fetch(self):
+        cache = client.TokenCache()
+        fetches = []
+        fetch_started = threading.Event()
+        release_fetch = threading.Event()
+
+        def fetch():
+            fetches.append(1)
+            fetch_started.set()
+            release_fetch.wait()
+            return "token", time.time() + 3600
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                        cache.get(fetch))) for _i in range(5)]
+        threads[0].start()
+        fetch_started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        release_fetch.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(results, ["token"] * 5)
+
+
+class TestFileTokenCache(tests.BaseTest):
+
+    def setUp(self):
+        super(TestFileTokenCache, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestFileTokenCache, self).tearDown()
+
+    def _cache(self, username="username"):
+        return client.FileTokenCache("http://localhost:5001",
+                                     username,
+                                     "tenant",
+                                     directory=self.directory)
+
+    def test_token_is_reused_by_another_cache_instance(self):
+        self._cache().get(lambda: ("token", time.time() + 3600))
+
+        other = self._cache()
+
+        self.assertEqual(other.get(lambda: ("other", None)), "token")
+        self.assertEqual(other.stats()['disk_hits'], 1)
+
+    def test_tokens_are_cached_per_user(self):
+        self._cache("user1").get(lambda: ("token1", time.time() + 3600))
+
+        token = self._cache("user2").get(lambda: ("token2", None))
+
+        self.assertEqual(token, "token2")
+
+    def test_cache_file_is_only_readable_by_owner(self):
+        cache = self._cache()
+        cache.get(lambda: ("token", time.time() + 3600))
+
+        self.assertEqual(stat.S_IMODE(os.stat(cache.path).st_mode), 0600)
+
+    def test_expired_token_on_disk_is_refetched(self):
+        self._cache().get(lambda: ("old", time.time() + 10))
+
+        token = self._cache().get(lambda: ("new", time.time() + 3600))
+
+        self.assertEqual(token, "new")
+
+    def test_invalidate_removes_token_from_disk(self):
+        cache = self._cache()
+        cache.get(lambda: ("old", time.time() + 3600))
+
+        cache.invalidate()
+
+        self.assertFalse(os.path.exists(cache.path))
+        self.assertEqual(self._cache().get(lambda: ("new", None)), "new")
+
+    def test_corrupt_cache_file_is_ignored(self):
+        cache = self._cache()
+        with open(cache.path, "w") as cache_file:
+            cache_file.write("not json")
+
+        self.assertEqual(cache.get(lambda: ("token", None)), "token")
@@ -0,0 +1,59 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import zlib
+
+from melange_client import compression
+from melange_client import tests
+
+
+class TestDecoder(tests.BaseTest):
+
+    def _decode_in_chunks(self, decoder, data, size=7):
+        chunks = [decoder.decode(data[i:i + size])
+                  for i in range(0, len(data), size)]
+        return "".join(chunks) + decoder.flush()
+
+    def test_decodes_gzip_in_chunks(self):
+        body = "ip_address " * 100
+
+        decoder = compression.decoder({'content-encoding': "gzip"})
+
+        self.assertEqual(self._decode_in_chunks(decoder,
+                                                compression.gzip(body)),
+                         body)
+
+    def test_decodes_zlib_and_raw_deflate(self):
+        body = "ip_address " * 100
+        raw = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+        for data in (zlib.compress(body), raw.compress(body) + raw.flush()):
+            decoder = compression.decoder({'content-encoding': "deflate"})
+            self.assertEqual(self._decode_in_chunks(decoder, data), body)
+
+    def test_plain_bodies_have_no_decoder(self):
+        self.assertEqual(compression.decoder({}), None)
+        self.assertEqual(compression.decoder({'content-encoding':
+                                              "identity"}), None)
+
+    def test_records_decoded_bytes(self):
+        stats = compression.TransferStats()
+        decoder = compression.Decoder("gzip", stats)
+
+        decoder.decode(compression.gzip("x" * 50))
+
+        self.assertEqual(stats.stats()['bytes_decoded'], 50)
@@ -0,0 +1,177 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+from melange_client import executor
+from melange_client import tests
+
+
+class TestExecutor(tests.BaseTest):
+
+    def setUp(self):
+        super(TestExecutor, self).setUp()
+        self.executor = executor.Executor(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        super(TestExecutor, self).tearDown()
+
+    def test_submit_returns_future_with_result(self):
+        future = self.executor.submit(lambda x, y: x + y, 1, y=2)
+
+        self.assertEqual(future.result(timeout=5), 3)
+        self.assertTrue(future.done())
+
+    def test_future_reraises_error_of_the_call(self):
+        def fail():
+            raise ValueError("failed")
+
+        future = self.executor.submit(fail)
+
+        self.assertRaisesExcMessage(ValueError, "failed", future.result, 5)
+        self.assertTrue(isinstance(future.exception(), ValueError))
+
+    def test_runs_at_most_max_workers_calls_at_once(self):
+        lock = threading.Lock()
+        release = threading.Event()
+        running = []
+        peak = []
+
+        def call():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            release.wait()
+            with lock:
+                running.pop()
+
+        futures = self.executor.map(lambda _i: call(), range(5))
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+
+        self.assertTrue(max(peak) <= 2)
+
+    def test_pending_calls_can_be_cancelled(self):
+        release = threading.Event()
+        blockers = [self.executor.submit(release.wait) for _i in range(2)]
+        pending = self.executor.submit(lambda: "never run")
+
+        self.assertTrue(pending.cancel())
+        release.set()
+
+        self.assertTrue(pending.cancelled())
+        self.assertRaises(executor.CancelledError, pending.result)
+        for blocker in blockers:
+            blocker.result(timeout=5)
+            self.assertFalse(blocker.cancel())
+
+    def test_result_times_out(self):
+        release = threading.Event()
+        future = self.executor.submit(release.wait)
+
+        self.assertRaises(executor.TimeoutError, future.result, 0.01)
+        release.set()
+
+    def test_as_completed_yields_futures_in_completion_order(self):
+        release = threading.Event()
+        slow = self.executor.submit(release.wait)
+        fast = self.executor.submit(lambda: "fast")
+
+        completed = executor.as_completed([slow, fast], timeout=5)
+
+        self.assertTrue(completed.next() is fast)
+        release.set()
+        self.assertTrue(completed.next() is slow)
+
+    def test_submit_fails_after_shutdown(self):
+        self.executor.shutdown()
+
+        self.assertRaises(RuntimeError, self.executor.submit, lambda: None)
+
+
+class TestRunBatch(tests.BaseTest):
+
+    def test_returns_results_in_item_order(self):
+        batch = executor.run_batch(lambda x: x * 2, range(20), concurrency=4)
+
+        self.assertEqual(batch.results, [x * 2 for x in range(20)])
+        self.assertEqual(batch.errors, {})
+
+    def test_collects_errors_without_aborting_the_batch(self):
+        def call(x):
+            if x % 2:
+                raise ValueError(x)
+            return x
+
+        batch = executor.run_batch(call, range(4), concurrency=2)
+
+        self.assertEqual(batch.results, [0, None, 2, None])
+        self.assertEqual(sorted(batch.errors), [1, 3])
+        self.assertEqual(batch.failed_items(), [1, 3])
+
+    def test_reports_throughput_and_latency_percentiles(self):
+        batch = executor.run_batch(lambda x: x, range(10))
+
+        stats = batch.stats()
+
+        self.assertEqual(stats['count'], 10)
+        self.assertEqual(stats['errors'], 0)
+        self.assertTrue(stats['throughput'] > 0)
+        self.assertTrue(stats['p50'] <= stats['p99'])
+
+
+class TestSingleFlight(tests.BaseTest):
+
+    def test_concurrent_calls_with_same_key_share_one_call(self):
+        single_flight = executor.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "result"
+
+        pool = executor.Executor(max_workers=3)
+        leader = pool.submit(single_flight.do, "key", call)
+        started.wait(5)
+        followers = [pool.submit(single_flight.do, "key", call)
+                     for i in range(2)]
+        while single_flight.coalesced < 2:
+            time.sleep(0.001)
+        release.set()
+
+        self.assertEqual(leader.result(5), ("result", False))
+        self.assertEqual([f.result(5) for f in followers],
+                         [("result", True), ("result", True)])
+        self.assertEqual(len(calls), 1)
+        pool.shutdown()
+
+    def test_error_is_raised_to_every_caller_and_key_is_released(self):
+        single_flight = executor.SingleFlight()
+
+        def fail():
+            raise ValueError("failed")
+
+        self.assertRaises(ValueError, single_flight.do, "key", fail)
+        self.assertEqual(single_flight.do("key", lambda: 1), (1, False))
+        self.assertEqual(single_flight.calls, 2)
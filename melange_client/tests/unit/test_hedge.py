@@ -0,0 +1,52 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from melange_client import hedge
+from melange_client import tests
+
+
+class TestHedgePolicy(tests.BaseTest):
+
+    def test_delay_defaults_to_max_delay_without_latencies(self):
+        policy = hedge.HedgePolicy(max_delay=0.5)
+
+        self.assertEqual(policy.delay(), 0.5)
+
+    def test_delay_follows_latency_percentile(self):
+        policy = hedge.HedgePolicy(percentile=90, min_delay=0, max_delay=10)
+
+        for latency in range(1, 11):
+            policy.record_latency(latency / 10.0)
+
+        self.assertEqual(policy.delay(), 0.9)
+
+    def test_delay_is_clamped(self):
+        policy = hedge.HedgePolicy(min_delay=0.1, max_delay=1)
+
+        policy.record_latency(0.001)
+        self.assertEqual(policy.delay(), 0.1)
+
+    def test_hedges_are_limited_by_budget(self):
+        policy = hedge.HedgePolicy(budget_ratio=0.25)
+        while policy.try_hedge():
+            pass
+
+        for _i in range(4):
+            policy.record_latency(0.01)
+
+        self.assertTrue(policy.try_hedge())
+        self.assertFalse(policy.try_hedge())
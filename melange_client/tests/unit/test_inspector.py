@@ -77,3 +77,21 @@ class TestMethodInspector(tests.BaseTest):
         method = inspector.MethodInspector(Foo().bar)
 
         self.assertEqual(str(method), "bar baz=<baz> [qux=<qux>]")
+
+
+class TestClassInspector(tests.BaseTest):
+
+    def test_methods_skips_private_and_non_cli_methods(self):
+        class Foo(object):
+            def bar(self):
+                pass
+
+            def _baz(self):
+                pass
+
+            @inspector.not_a_cli_action
+            def qux(self, specs):
+                pass
+
+        self.assertEqual(inspector.ClassInspector(Foo()).methods().keys(),
+                         ['bar'])
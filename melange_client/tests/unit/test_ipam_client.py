@@ -16,8 +16,22 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import inspect
+import json
+import threading
+
+import mox
+
+from melange_client import cache
+from melange_client import client
+from melange_client import exception
+from melange_client import executor
+from melange_client import inspector
 from melange_client import ipam_client
+from melange_client import metrics
+from melange_client import slowlog
 from melange_client import tests
+from melange_client import tracing
 
 
 class TestFactory(tests.BaseTest):
@@ -27,6 +41,65 @@ class TestFactory(tests.BaseTest):
 
         self.assertEquals(ipam_client.IpBlockClient, type(factory.ip_block))
 
+    def test_factory_memoizes_clients(self):
+        factory = ipam_client.Factory("host", "8080")
+
+        self.assertTrue(factory.ip_block is factory.ip_block)
+
+    def test_factory_clients_share_transport_and_auth_client(self):
+        factory = ipam_client.Factory("host", "8080",
+                                      auth_url="http://localhost:5001")
+
+        self.assertTrue(factory.ip_block.resource.client is
+                        factory.policy.resource.client)
+        self.assertTrue(factory.ip_block.resource.auth_client is
+                        factory.policy.resource.auth_client)
+
+    def test_factory_passes_timeout_to_transport(self):
+        factory = ipam_client.Factory("host", "8080", timeout=5)
+
+        http_client = factory.ip_block.resource.client
+
+        self.assertEqual(http_client.timeout, 5)
+        self.assertFalse(http_client.use_ssl)
+
+    def test_factory_balances_across_listed_endpoints(self):
+        factory = ipam_client.Factory("host1,host2:9000", 8080)
+
+        endpoints = factory.ip_block.resource.client.balancer.endpoints
+
+        self.assertEqual([(e.host, e.port) for e in endpoints],
+                         [("host1", 8080), ("host2", 9000)])
+
+    def test_factory_close_releases_pooled_connections(self):
+        factory = ipam_client.Factory("host", "8080")
+        http_client = factory.ip_block.resource.client
+        self.mock.StubOutWithMock(http_client, "close")
+        http_client.close()
+        self.mock.ReplayAll()
+
+        with factory:
+            pass
+
+        self.mock.VerifyAll()
+        self.assertFalse(factory.ip_block.resource.client is http_client)
+
+    def test_map_grows_pool_to_its_concurrency(self):
+        factory = ipam_client.Factory("host", "8080")
+
+        result = factory.map(lambda item: item * 2, range(5), concurrency=50)
+
+        self.assertEqual(result.results, [0, 2, 4, 6, 8])
+        self.assertEqual(factory.ip_block.resource.client.pool.max_size, 50)
+
+    def test_map_does_not_shrink_pool(self):
+        factory = ipam_client.Factory(
+            "host", "8080", pool=client.ConnectionPool(max_size=20))
+
+        factory.map(lambda item: item, range(5), concurrency=5)
+
+        self.assertEqual(factory.ip_block.resource.client.pool.max_size, 20)
+
     def test_factory_raises_attribute_error_for_non_existent_client(self):
         factory = ipam_client.Factory("host", "8080")
 
@@ -34,3 +107,476 @@ class TestFactory(tests.BaseTest):
                                     "Factory has no attribute "
                                     "non_existent_client",
                                      lambda: factory.non_existent_client)
+
+
+class TestAsyncFactory(tests.BaseTest):
+
+    def test_client_methods_return_futures(self):
+        factory = ipam_client.AsyncFactory("host", "8080", concurrency=2)
+        self.mock.StubOutWithMock(ipam_client.Resource, "find")
+        ipam_client.Resource.find("1").AndReturn({'ip_block': {'id': "1"}})
+        self.mock.ReplayAll()
+
+        with factory:
+            future = factory.ip_block.show("1")
+
+            self.assertEqual(future.result(timeout=5),
+                             {'ip_block': {'id': "1"}})
+        self.mock.VerifyAll()
+        self.mock.UnsetStubs()
+
+    def test_factory_can_be_used_again_after_close(self):
+        factory = ipam_client.AsyncFactory("host", "8080", concurrency=2)
+        self.mock.StubOutWithMock(ipam_client.Resource, "find")
+        ipam_client.Resource.find("1").AndReturn({'ip_block': {'id': "1"}})
+        ipam_client.Resource.find("2").AndReturn({'ip_block': {'id': "2"}})
+        self.mock.ReplayAll()
+
+        factory.ip_block.show("1").result(timeout=5)
+        factory.close()
+        future = factory.ip_block.show("2")
+
+        self.assertEqual(future.result(timeout=5), {'ip_block': {'id': "2"}})
+        factory.close()
+        self.mock.VerifyAll()
+        self.mock.UnsetStubs()
+
+    def test_connection_pool_is_sized_for_concurrency(self):
+        factory = ipam_client.AsyncFactory("host", "8080", concurrency=20)
+
+        self.assertEqual(factory.ip_block.client.resource.client.pool.max_size,
+                         20)
+        factory.close()
+
+
+class TestCategoryClients(tests.BaseTest):
+
+    def test_every_listable_client_can_stream_its_list(self):
+        listable = [cls for cls in vars(ipam_client).values()
+                    if isinstance(cls, type)
+                    and issubclass(cls, ipam_client.BaseClient)
+                    and hasattr(cls, "list")]
+
+        self.assertTrue(ipam_client.IpBlockClient in listable)
+        for cls in listable:
+            self.assertEqual(inspect.getargspec(cls.stream_list),
+                             inspect.getargspec(cls.list))
+
+    def test_ip_block_stream_list_streams_ip_blocks(self):
+        ip_block_client = ipam_client.IpBlockClient(None, None, "tenant")
+        self.mock.StubOutWithMock(ip_block_client.resource, "stream_all")
+        ip_block_client.resource.stream_all().AndReturn(iter([{'id': "1"}]))
+        self.mock.ReplayAll()
+
+        self.assertEqual(list(ip_block_client.stream_list()), [{'id': "1"}])
+        self.mock.VerifyAll()
+
+
+class TestIpAddressClient(tests.BaseTest):
+
+    def test_create_many_is_not_a_cli_action(self):
+        ip_client = ipam_client.IpAddressClient(None, None, "tenant")
+
+        actions = inspector.ClassInspector(ip_client).methods()
+
+        self.assertTrue('create' in actions)
+        self.assertFalse('create_many' in actions)
+
+    def test_create_many_yields_result_for_every_spec(self):
+        ip_client = ipam_client.IpAddressClient(None, None, "tenant")
+        self.mock.StubOutWithMock(ip_client, "create")
+        ip_client.create("block", used_by_device="dev1").AndReturn("ip1")
+        ip_client.create("block", used_by_device="dev2").AndRaise(
+            exception.MelangeServiceResponseError("block is full", 422))
+        self.mock.ReplayAll()
+
+        specs = [dict(used_by_device="dev1"), dict(used_by_device="dev2")]
+        results = list(ip_client.create_many("block", specs, concurrency=1))
+
+        self.assertEqual(len(results), 2)
+        self.assertTrue((specs[0], "ip1", None) in results)
+        failed = [result for result in results if result[2] is not None]
+        self.assertEqual(failed[0][0], specs[1])
+        self.assertTrue(isinstance(failed[0][2],
+                                   exception.MelangeServiceResponseError))
+        self.mock.VerifyAll()
+
+
+class TestResource(tests.BaseTest):
+
+    def setUp(self):
+        super(TestResource, self).setUp()
+        self.http_client = self.mock.CreateMock(client.HTTPClient)
+        for attribute in ("single_flight", "response_cache", "metrics",
+                          "tracer", "slow_log"):
+            setattr(self.http_client, attribute, None)
+        self.auth_client = self.mock.CreateMock(client.AuthorizationClient)
+        self.resource = ipam_client.Resource("ip_blocks",
+                                             "ip_block",
+                                             self.http_client,
+                                             self.auth_client)
+
+    def _response(self, body):
+        response = self.mock.CreateMock(client.Response)
+        response.read().AndReturn(body)
+        return response
+
+    def _cacheable_response(self, body, etag=None, last_modified=None):
+        response = self._response(body)
+        response.getheader('etag').AndReturn(etag)
+        response.getheader('last-modified').AndReturn(last_modified)
+        return response
+
+    def test_request_renews_token_and_retries_once_when_unauthorized(self):
+        self.auth_client.get_token().AndReturn("expired_token")
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks",
+                                    params={},
+                                    headers=mox.IgnoreArg()).AndRaise(
+            exception.MelangeServiceResponseError("unauthorized", 401))
+        self.auth_client.invalidate_token().AndReturn(True)
+        self.auth_client.get_token().AndReturn("new_token")
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks",
+                                    params={},
+                                    headers={'Content-Type':
+                                                 "application/json",
+                                             'X-AUTH-TOKEN': "new_token"}
+                                    ).AndReturn(self._response('{"a": 1}'))
+
+        self.mock.ReplayAll()
+        self.assertEqual(self.resource.all(), {"a": 1})
+        self.mock.VerifyAll()
+
+    def test_request_does_not_retry_other_errors(self):
+        self.auth_client.get_token().AndReturn("token")
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks/1",
+                                    headers=mox.IgnoreArg()).AndRaise(
+            exception.MelangeServiceResponseError("not found", 404))
+
+        self.mock.ReplayAll()
+        self.assertRaises(exception.MelangeServiceResponseError,
+                          self.resource.find, 1)
+        self.mock.VerifyAll()
+
+    def test_concurrent_identical_gets_are_sent_once(self):
+        self.http_client.single_flight = executor.SingleFlight()
+        self.auth_client.get_token().AndReturn("token")
+        release = threading.Event()
+
+        def respond(*args, **kwargs):
+            release.wait(5)
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks/1",
+                                    headers=mox.IgnoreArg()).WithSideEffects(
+            respond).AndReturn(self._response('{"ip_block": {"id": 1}}'))
+
+        self.mock.ReplayAll()
+        pool = executor.Executor(max_workers=3)
+        futures = [pool.submit(self.resource.find, 1) for i in range(3)]
+        while self.http_client.single_flight.coalesced < 2:
+            release.wait(0.001)
+        release.set()
+        results = [future.result(5) for future in futures]
+        pool.shutdown()
+
+        self.assertEqual(results, [{'ip_block': {'id': 1}}] * 3)
+        results[0]['ip_block'].pop('id')
+        results[1]['ip_block']['id'] = 2
+        self.assertEqual(results[2], {'ip_block': {'id': 1}})
+        self.mock.VerifyAll()
+
+    def test_find_and_all_are_served_from_response_cache(self):
+        self.http_client.response_cache = cache.ResponseCache()
+        self.auth_client.get_token().MultipleTimes().AndReturn("token")
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks/1",
+                                    headers=mox.IgnoreArg()).AndReturn(
+            self._cacheable_response('{"ip_block": {"id": 1}}'))
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks",
+                                    params={'type': "public"},
+                                    headers=mox.IgnoreArg()).AndReturn(
+            self._cacheable_response('{"ip_blocks": []}'))
+
+        self.mock.ReplayAll()
+        for i in range(2):
+            self.assertEqual(self.resource.find(1), {'ip_block': {'id': 1}})
+            self.assertEqual(self.resource.all(type="public"),
+                             {'ip_blocks': []})
+        self.mock.VerifyAll()
+        self.assertEqual(self.http_client.response_cache.stats()['hits'], 2)
+
+    def test_changing_a_result_does_not_change_the_cached_response(self):
+        self.http_client.response_cache = cache.ResponseCache()
+        self.auth_client.get_token().AndReturn("token")
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks/1",
+                                    headers=mox.IgnoreArg()).AndReturn(
+            self._cacheable_response('{"ip_block": {"id": 1}}'))
+
+        self.mock.ReplayAll()
+        self.resource.find(1)['ip_block'].pop('id')
+        self.resource.find(1)['ip_block']['id'] = 2
+
+        self.assertEqual(self.resource.find(1), {'ip_block': {'id': 1}})
+        self.mock.VerifyAll()
+
+    def test_writes_invalidate_cached_responses(self):
+        self.http_client.response_cache = cache.ResponseCache()
+        self.auth_client.get_token().MultipleTimes().AndReturn("token")
+        for response in (self._cacheable_response('{"ip_block": {"id": 1}}'),
+                         self._response(None),
+                         self._cacheable_response('{"ip_block": null}')):
+            self.http_client.do_request(mox.IgnoreArg(),
+                                        "/v0.1/ipam/ip_blocks/1",
+                                        headers=mox.IgnoreArg()).AndReturn(
+                response)
+
+        self.mock.ReplayAll()
+        self.resource.find(1)
+        self.resource.delete(1)
+        self.assertEqual(self.resource.find(1), {'ip_block': None})
+        self.mock.VerifyAll()
+
+    def test_expired_entries_are_revalidated_with_conditional_get(self):
+        self.http_client.response_cache = cache.ResponseCache(ttl=-1)
+        self.auth_client.get_token().MultipleTimes().AndReturn("token")
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks/1",
+                                    headers=mox.IgnoreArg()).AndReturn(
+            self._cacheable_response('{"ip_block": {"id": 1}}', '"v1"',
+                                     "Sat, 01 Jan 2011 00:00:00 GMT"))
+        not_modified = self.mock.CreateMock(client.Response)
+        not_modified.status = 304
+        self.http_client.do_request(
+            "GET",
+            "/v0.1/ipam/ip_blocks/1",
+            headers={'Content-Type': "application/json",
+                     'X-AUTH-TOKEN': "token",
+                     'If-None-Match': '"v1"',
+                     'If-Modified-Since': "Sat, 01 Jan 2011 00:00:00 GMT"}
+            ).AndReturn(not_modified)
+
+        self.mock.ReplayAll()
+        self.resource.find(1)
+        self.assertEqual(self.resource.find(1), {'ip_block': {'id': 1}})
+        self.mock.VerifyAll()
+        stats = self.http_client.response_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['revalidations'], 1)
+
+    def test_request_records_metrics(self):
+        self.http_client.metrics = metrics.ClientMetrics()
+        self.auth_client.get_token().MultipleTimes().AndReturn("token")
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks/1",
+                                    headers=mox.IgnoreArg()).AndRaise(
+            exception.MelangeServiceResponseError("not found", 404))
+
+        self.mock.ReplayAll()
+        self.assertRaises(exception.MelangeServiceResponseError,
+                          self.resource.find, 1)
+        self.mock.VerifyAll()
+        self.assertEqual(self.http_client.metrics.errors.collect(),
+                         {('ip_block', 'GET', '404'): 1})
+
+    def test_factory_exports_pool_and_token_cache_metrics(self):
+        factory = ipam_client.Factory("host", "8080",
+                                      metrics=metrics.ClientMetrics())
+        factory.ip_block
+
+        text = metrics.prometheus_text(factory.metrics.registry)
+
+        self.assertTrue('melange_client_pool_connections{state="idle"} 0.0'
+                        in text)
+        self.assertTrue("melange_client_token_cache_hit_rate 0.0" in text)
+
+    def test_reopened_factory_reports_only_its_new_pool(self):
+        factory = ipam_client.Factory("host", "8080",
+                                      metrics=metrics.ClientMetrics())
+        old_pool = factory.ip_block.resource.client.pool
+        self.mock.stubs.Set(old_pool, "stats",
+                            lambda: dict(in_use=0, idle=5))
+
+        factory.close()
+        self.assertFalse(factory.ip_block.resource.client.pool is old_pool)
+
+        text = metrics.prometheus_text(factory.metrics.registry)
+        self.assertTrue('melange_client_pool_connections{state="idle"} 0.0'
+                        in text)
+        factory.close()
+
+    def test_traced_client_call_has_auth_and_decode_child_spans(self):
+        tracer = tracing.Tracer()
+        self.http_client.tracer = tracer
+        self.auth_client.get_token().AndReturn("token")
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks/1",
+                                    headers=mox.IgnoreArg()).AndReturn(
+            self._response('{"ip_block": {"id": 1}}'))
+
+        self.mock.ReplayAll()
+        traced = ipam_client.TracedClient(self.resource, tracer, "ip_block")
+        self.assertEqual(traced.find(1), {'ip_block': {'id': 1}})
+        self.mock.VerifyAll()
+
+        auth, decode, call = tracer.exporter.spans
+        self.assertEqual([auth.name, decode.name, call.name],
+                         ["auth", "decode", "ip_block.find"])
+        self.assertEqual(auth.parent_id, call.span_id)
+        self.assertEqual(decode.parent_id, call.span_id)
+
+    def test_factory_traces_category_clients_when_given_a_tracer(self):
+        factory = ipam_client.Factory("host", "8080",
+                                      tracer=tracing.Tracer())
+
+        self.assertTrue(isinstance(factory.ip_block,
+                                   ipam_client.TracedClient))
+        self.assertTrue(factory.ip_block.TENANT_ID_REQUIRED)
+
+    def test_slow_requests_are_logged_with_tenant_and_status(self):
+        slow_log = self.mock.CreateMock(slowlog.SlowRequestLog)
+        slow_call = self.mock.CreateMock(slowlog.SlowCall)
+        self.http_client.slow_log = slow_log
+        self.auth_client.get_token().AndReturn("token")
+        slow_log.start().AndReturn(slow_call)
+        response = self._response('{"ip_block": {"id": 1}}')
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks/1",
+                                    headers=mox.IgnoreArg()).AndReturn(
+            response)
+        slow_call.finish("GET", "/v0.1/ipam/ip_blocks/1", None, response)
+
+        self.mock.ReplayAll()
+        self.resource.find(1)
+        self.mock.VerifyAll()
+
+    def test_failed_slow_requests_are_logged_with_their_error(self):
+        slow_log = self.mock.CreateMock(slowlog.SlowRequestLog)
+        slow_call = self.mock.CreateMock(slowlog.SlowCall)
+        self.http_client.slow_log = slow_log
+        self.auth_client.get_token().AndReturn("token")
+        slow_log.start().AndReturn(slow_call)
+        error = exception.MelangeServiceResponseError("not found", 404)
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks/1",
+                                    headers=mox.IgnoreArg()).AndRaise(error)
+        slow_call.finish("GET", "/v0.1/ipam/ip_blocks/1", None, error)
+
+        self.mock.ReplayAll()
+        self.assertRaises(exception.MelangeServiceResponseError,
+                          self.resource.find, 1)
+        self.mock.VerifyAll()
+
+    def test_factory_coalesces_gets_only_when_asked_to(self):
+        self.assertEqual(ipam_client.Factory("host", "8080")._client()
+                         .single_flight, None)
+        self.assertTrue(isinstance(
+            ipam_client.Factory("host", "8080", coalesce_gets=True)
+            ._client().single_flight, executor.SingleFlight))
+
+    def test_factory_clients_share_token_cache(self):
+        factory = ipam_client.Factory("host", "8080",
+                                      auth_url="http://localhost:5001")
+
+        self.assertTrue(factory.ip_block.resource.auth_client.token_cache is
+                        factory.policy.resource.auth_client.token_cache)
+
+    def test_iter_all_pages_through_collection_with_marker(self):
+        self.auth_client.get_token().MultipleTimes().AndReturn("token")
+        pages = {None: [{'id': "1"}, {'id': "2"}],
+                 "2": [{'id': "3"}, {'id': "4"}],
+                 "4": [{'id': "5"}]}
+        for marker, page in sorted(pages.items()):
+            params = dict(limit=2, marker=marker) if marker else dict(limit=2)
+            response = self._response(json.dumps({'ip_blocks': page}))
+            self.http_client.do_request("GET",
+                                        "/v0.1/ipam/ip_blocks",
+                                        params=params,
+                                        headers=mox.IgnoreArg()).AndReturn(
+                response)
+
+        self.mock.ReplayAll()
+        members = list(self.resource.iter_all(limit=2))
+
+        self.assertEqual([member['id'] for member in members],
+                         ["1", "2", "3", "4", "5"])
+        self.mock.VerifyAll()
+
+    def test_iter_all_accepts_limit_given_as_string(self):
+        self.auth_client.get_token().MultipleTimes().AndReturn("token")
+        pages = {None: [{'id': "1"}, {'id': "2"}], "2": [{'id': "3"}]}
+        for marker, page in sorted(pages.items()):
+            params = dict(limit=2, marker=marker) if marker else dict(limit=2)
+            self.http_client.do_request("GET",
+                                        "/v0.1/ipam/ip_blocks",
+                                        params=params,
+                                        headers=mox.IgnoreArg()).AndReturn(
+                self._response(json.dumps({'ip_blocks': page})))
+
+        self.mock.ReplayAll()
+        members = list(self.resource.iter_all(limit="2"))
+
+        self.assertEqual([member['id'] for member in members],
+                         ["1", "2", "3"])
+        self.mock.VerifyAll()
+
+    def test_iter_all_stops_when_server_ignores_pagination(self):
+        self.auth_client.get_token().AndReturn("token")
+        page = [{'id': "1"}, {'id': "2"}, {'id': "3"}]
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks",
+                                    params=dict(limit=2),
+                                    headers=mox.IgnoreArg()).AndReturn(
+            self._response(json.dumps({'ip_blocks': page})))
+
+        self.mock.ReplayAll()
+        self.assertEqual(len(list(self.resource.iter_all(limit=2))), 3)
+        self.mock.VerifyAll()
+
+    def test_stream_all_yields_members_decoded_from_response(self):
+        self.auth_client.get_token().AndReturn("token")
+        response = self.mock.CreateMock(client.StreamingResponse)
+        response.iter_chunks().AndReturn(iter(['{"ip_blocks": [{"id"',
+                                               ': "1"}, {"id": "2"}]}']))
+        response.close()
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks",
+                                    params={},
+                                    headers=mox.IgnoreArg(),
+                                    stream=True).AndReturn(response)
+
+        self.mock.ReplayAll()
+        self.assertEqual(list(self.resource.stream_all()),
+                         [{'id': "1"}, {'id': "2"}])
+        self.mock.VerifyAll()
+
+    def test_stream_all_renews_token_and_retries_when_unauthorized(self):
+        self.http_client.metrics = metrics.ClientMetrics()
+        self.auth_client.get_token().AndReturn("expired_token")
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks",
+                                    params={},
+                                    headers=mox.IgnoreArg(),
+                                    stream=True).AndRaise(
+            exception.MelangeServiceResponseError("unauthorized", 401))
+        self.auth_client.invalidate_token().AndReturn(True)
+        self.auth_client.get_token().AndReturn("new_token")
+        response = self.mock.CreateMock(client.StreamingResponse)
+        response.iter_chunks().AndReturn(iter(['{"ip_blocks": []}']))
+        response.close()
+        self.http_client.do_request("GET",
+                                    "/v0.1/ipam/ip_blocks",
+                                    params={},
+                                    headers={'Content-Type':
+                                                 "application/json",
+                                             'X-AUTH-TOKEN': "new_token"},
+                                    stream=True).AndReturn(response)
+
+        self.mock.ReplayAll()
+        self.assertEqual(list(self.resource.stream_all()), [])
+        self.mock.VerifyAll()
+        self.assertEqual(self.http_client.metrics.requests.collect(),
+                         {('ip_block', 'GET'): 1})
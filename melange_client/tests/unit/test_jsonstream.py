@@ -0,0 +1,62 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+from melange_client import jsonstream
+from melange_client import tests
+
+
+def chunked(string, size):
+    return [string[i:i + size] for i in range(0, len(string), size)]
+
+
+class TestIterItems(tests.BaseTest):
+
+    def test_yields_members_of_named_array(self):
+        members = [{'id': "1", 'cidr': "10.0.0.0/24"},
+                   {'id': "2", 'name': 'with "quotes", [brackets] and \\'}]
+        body = json.dumps({'ip_blocks': members, 'other': [1, 2]})
+
+        for size in (1, 3, 1024):
+            items = list(jsonstream.iter_items(chunked(body, size),
+                                               "ip_blocks"))
+            self.assertEqual(items, members)
+
+    def test_yields_members_of_first_array_without_key(self):
+        body = ('{"ip_addresses_links": [{"rel": "next"}], "name": "[x]", '
+                '"ip_addresses": [1, "two", null, true, [3], {"4": 4}]}')
+
+        items = list(jsonstream.iter_items(chunked(body, 2)))
+
+        self.assertEqual(items, [1, "two", None, True, [3], {"4": 4}])
+
+    def test_yields_nothing_for_empty_collection(self):
+        self.assertEqual(list(jsonstream.iter_items(['{"ip_blocks": []}'])),
+                         [])
+
+    def test_members_are_yielded_before_the_body_ends(self):
+        scanner = jsonstream.ArrayScanner()
+
+        self.assertEqual(scanner.feed('{"ip_blocks": [{"id": 1}, {"id"'),
+                         [{'id': 1}])
+        self.assertEqual(scanner.feed(': 2}]}'), [{'id': 2}])
+
+    def test_raises_error_for_truncated_body(self):
+        items = jsonstream.iter_items(['{"ip_blocks": [{"id": 1}, {"i'])
+
+        self.assertRaises(ValueError, list, items)
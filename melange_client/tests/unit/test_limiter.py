@@ -0,0 +1,120 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+from melange_client import limiter
+from melange_client import tests
+
+
+class TestTokenBucket(tests.BaseTest):
+
+    def test_allows_bursts_up_to_burst_size(self):
+        bucket = limiter.TokenBucket(rate=1, burst=3)
+
+        waits = [bucket.try_acquire() for _i in range(4)]
+
+        self.assertEqual(waits[:3], [None, None, None])
+        self.assertTrue(0 < waits[3] <= 1)
+
+    def test_refills_at_rate(self):
+        bucket = limiter.TokenBucket(rate=1000, burst=1)
+        bucket.try_acquire()
+
+        bucket.acquire()
+
+        self.assertNotEqual(bucket.try_acquire(), None)
+
+
+class TestRateLimiter(tests.BaseTest):
+
+    def test_limits_each_endpoint_separately(self):
+        rate_limiter = limiter.RateLimiter(endpoint_rate=1, burst=1)
+
+        rate_limiter.acquire("host1:80")
+        rate_limiter.acquire("host2:80")
+
+        bucket = rate_limiter._bucket(("endpoint", "host1:80"), 1)
+        self.assertNotEqual(bucket.try_acquire(), None)
+
+    def test_limits_each_tenant_separately(self):
+        rate_limiter = limiter.RateLimiter(tenant_rate=1, burst=1)
+
+        rate_limiter.acquire("host:80", "tenant1")
+        rate_limiter.acquire("host:80", "tenant2")
+        rate_limiter.acquire("host:80")
+
+        bucket = rate_limiter._bucket(("tenant", "tenant1"), 1)
+        self.assertNotEqual(bucket.try_acquire(), None)
+
+
+class TestAdaptiveConcurrencyLimit(tests.BaseTest):
+
+    def test_limit_grows_while_latency_is_steady(self):
+        concurrency = limiter.AdaptiveConcurrencyLimit(initial_limit=2)
+
+        for _i in range(10):
+            concurrency.acquire()
+            concurrency.release(0.01)
+
+        self.assertTrue(concurrency.limit > 2)
+
+    def test_limit_shrinks_when_latency_rises(self):
+        concurrency = limiter.AdaptiveConcurrencyLimit(initial_limit=10,
+                                                       tolerance=2)
+        concurrency.acquire()
+        concurrency.release(0.01)
+
+        concurrency.acquire()
+        concurrency.release(0.1)
+
+        self.assertTrue(concurrency.limit < 10)
+
+    def test_limit_shrinks_on_overload(self):
+        concurrency = limiter.AdaptiveConcurrencyLimit(initial_limit=10)
+
+        concurrency.acquire()
+        concurrency.release(0.01, overloaded=True)
+
+        self.assertTrue(concurrency.limit < 10)
+
+    def test_limit_never_drops_below_minimum(self):
+        concurrency = limiter.AdaptiveConcurrencyLimit(initial_limit=2,
+                                                       min_limit=1)
+
+        for _i in range(50):
+            concurrency.acquire()
+            concurrency.release(1, overloaded=True)
+
+        self.assertEqual(concurrency.stats()['limit'], 1)
+
+    def test_acquire_blocks_at_the_limit(self):
+        concurrency = limiter.AdaptiveConcurrencyLimit(initial_limit=1)
+        concurrency.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            concurrency.acquire()
+            acquired.set()
+
+        waiter = threading.Thread(target=acquire)
+        waiter.start()
+        self.assertFalse(acquired.wait(0.05))
+        concurrency.release(0.01)
+        waiter.join(5)
+
+        self.assertTrue(acquired.is_set())
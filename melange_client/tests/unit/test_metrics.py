@@ -0,0 +1,205 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+import threading
+
+from melange_client import balancer
+from melange_client import exception
+from melange_client import metrics
+from melange_client import tests
+
+
+class TestRegistry(tests.BaseTest):
+
+    def test_counter_sums_increments_from_all_threads(self):
+        counter = metrics.Registry().counter("requests", "Requests.",
+                                             ("method",))
+
+        def work():
+            for i in range(1000):
+                counter.inc(("GET",))
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(("POST",), 2)
+
+        self.assertEqual(counter.collect(), {('GET',): 4000, ('POST',): 2})
+
+    def test_histogram_counts_are_cumulative(self):
+        histogram = metrics.Registry().histogram("latency", "Latency.",
+                                                 buckets=(0.1, 1))
+
+        for value in (0.05, 0.5, 0.7, 5):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.collect(), {(): ([1, 3, 4], 6.25, 4)})
+
+    def test_samples_of_exited_threads_are_kept_without_their_shards(self):
+        registry = metrics.Registry()
+        counter = registry.counter("requests", "Requests.")
+        histogram = registry.histogram("latency", "Latency.",
+                                       buckets=(0.1, 1))
+
+        def work():
+            counter.inc()
+            histogram.observe(0.5)
+        for i in range(100):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(counter.collect(), {(): 100})
+        self.assertEqual(histogram.collect(), {(): ([0, 100, 100], 50.0,
+                                                    100)})
+        self.assertEqual(len(counter._shards), 0)
+        self.assertEqual(len(histogram._shards), 0)
+
+    def test_metrics_are_registered_once_per_name(self):
+        registry = metrics.Registry()
+
+        self.assertTrue(registry.counter("a", "A.") is
+                        registry.counter("a", "A."))
+
+
+class TestClientMetrics(tests.BaseTest):
+
+    def test_records_requests_errors_and_latency(self):
+        client_metrics = metrics.ClientMetrics()
+
+        client_metrics.record_request("ip_block", "GET", 0.2)
+        client_metrics.record_request(
+            "ip_block", "GET", 0.3,
+            exception.MelangeServiceResponseError("not found", 404))
+        client_metrics.record_request(
+            "ip_block", "POST", 0.1, exception.ClientConnectionError("down"))
+
+        self.assertEqual(client_metrics.requests.collect(),
+                         {('ip_block', 'GET'): 2, ('ip_block', 'POST'): 1})
+        self.assertEqual(client_metrics.errors.collect(),
+                         {('ip_block', 'GET', '404'): 1,
+                          ('ip_block', 'POST', 'ClientConnectionError'): 1})
+        self.assertEqual(
+            client_metrics.latency.collect()[('ip_block', 'GET')][2], 2)
+
+    def test_watch_breakers_reports_circuit_state_per_endpoint(self):
+        client_metrics = metrics.ClientMetrics()
+        endpoints = balancer.Balancer([("host1", 80), ("host2", 80)],
+                                      failure_threshold=1)
+        client_metrics.watch_breakers(endpoints)
+
+        endpoints.endpoints[1].breaker.record_failure()
+        states = client_metrics.registry.metrics()[-1].collect()
+
+        self.assertEqual(len(states), 6)
+        self.assertEqual(sorted(labels for labels, value in states.items()
+                                if value),
+                         [("host1:80", "closed"), ("host2:80", "open")])
+
+    def test_pool_gauge_adds_up_watched_pools_until_unwatched(self):
+        client_metrics = metrics.ClientMetrics()
+        first, second = FakePool(in_use=1, idle=2), FakePool(idle=3)
+        client_metrics.watch_pool(first)
+        client_metrics.watch_pool(second)
+        gauge = client_metrics.registry.metrics()[-1]
+
+        self.assertEqual(gauge.collect(), {('in_use',): 1, ('idle',): 5})
+        client_metrics.unwatch(first)
+        self.assertEqual(gauge.collect(), {('in_use',): 0, ('idle',): 3})
+
+
+class FakePool(object):
+
+    def __init__(self, in_use=0, idle=0):
+        self.in_use = in_use
+        self.idle = idle
+
+    def stats(self):
+        return dict(in_use=self.in_use, idle=self.idle)
+
+
+class TestExporters(tests.BaseTest):
+
+    def test_prometheus_text(self):
+        registry = metrics.Registry()
+        registry.counter("requests_total", "Requests.",
+                         ("method",)).inc(("GET",), 3)
+        registry.histogram("latency_seconds", "Latency.",
+                           buckets=(0.5,)).observe(0.2)
+        registry.gauge("hit_rate", "Hit rate.", lambda: 0.5)
+
+        self.assertEqual(metrics.prometheus_text(registry).splitlines(), [
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{method="GET"} 3.0',
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{le="0.5"} 1.0',
+            'latency_seconds_bucket{le="+Inf"} 1.0',
+            'latency_seconds_sum 0.2',
+            'latency_seconds_count 1.0',
+            '# HELP hit_rate Hit rate.',
+            '# TYPE hit_rate gauge',
+            'hit_rate 0.5'])
+
+    def test_statsd_sends_counter_deltas_and_gauges(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        exporter = metrics.StatsdExporter("127.0.0.1",
+                                          server.getsockname()[1])
+        client_metrics = metrics.ClientMetrics()
+        client_metrics.registry.gauge("melange_client_pool_idle", "Idle.",
+                                      lambda: 2)
+
+        client_metrics.record_retry("GET")
+        exporter.flush(client_metrics.registry)
+        client_metrics.record_retry("GET")
+        exporter.flush(client_metrics.registry)
+
+        server.recv(512)
+        self.assertEqual(server.recv(512).splitlines(),
+                         ["melange_client.retries_total.GET:1|c",
+                          "melange_client.pool_idle:2|g"])
+        exporter.close()
+        server.close()
+
+    def test_statsd_sends_histogram_sum_and_count_as_deltas(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        exporter = metrics.StatsdExporter("127.0.0.1",
+                                          server.getsockname()[1])
+        registry = metrics.Registry()
+        latency = registry.histogram("melange_client_latency", "Latency.")
+
+        latency.observe(0.5)
+        latency.observe(0.25)
+        exporter.flush(registry)
+        latency.observe(0.5)
+        exporter.flush(registry)
+
+        self.assertEqual(server.recv(512).splitlines(),
+                         ["melange_client.latency.sum:0.75|c",
+                          "melange_client.latency.count:2|c"])
+        self.assertEqual(server.recv(512).splitlines(),
+                         ["melange_client.latency.sum:0.5|c",
+                          "melange_client.latency.count:1|c"])
+        exporter.close()
+        server.close()
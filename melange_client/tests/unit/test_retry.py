@@ -0,0 +1,100 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from melange_client import exception
+from melange_client import retry
+from melange_client import tests
+
+
+def service_error(status, headers=None):
+    return exception.MelangeServiceResponseError("error", status, headers)
+
+
+class TestRetryPolicy(tests.BaseTest):
+
+    def test_retries_idempotent_methods_on_unavailable_server(self):
+        policy = retry.RetryPolicy(backoff_base=1, backoff_max=10)
+
+        for attempt in range(3):
+            delay = policy.delay("GET", attempt, service_error(503))
+            self.assertTrue(0 <= delay <= 2 ** attempt)
+        self.assertEqual(policy.retries, 3)
+
+    def test_retries_connection_errors(self):
+        policy = retry.RetryPolicy()
+        error = exception.ClientConnectionError("connection refused")
+
+        self.assertNotEqual(policy.delay("DELETE", 0, error), None)
+
+    def test_does_not_retry_non_idempotent_methods(self):
+        policy = retry.RetryPolicy()
+
+        self.assertEqual(policy.delay("POST", 0, service_error(503)), None)
+
+    def test_does_not_retry_client_errors(self):
+        policy = retry.RetryPolicy()
+
+        self.assertEqual(policy.delay("GET", 0, service_error(404)), None)
+
+    def test_gives_up_after_max_retries(self):
+        policy = retry.RetryPolicy(max_retries=2)
+
+        self.assertEqual(policy.delay("GET", 2, service_error(503)), None)
+
+    def test_honours_retry_after(self):
+        policy = retry.RetryPolicy(backoff_max=10)
+        error = service_error(503, {'retry-after': "7"})
+
+        self.assertEqual(policy.delay("GET", 0, error), 7)
+
+    def test_gives_up_when_retry_after_is_longer_than_allowed(self):
+        policy = retry.RetryPolicy(backoff_max=10)
+        error = service_error(503, {'retry-after': "30"})
+
+        self.assertEqual(policy.delay("GET", 0, error), None)
+        self.assertEqual(policy.retries, 0)
+
+    def test_max_retry_after_can_exceed_backoff_max(self):
+        policy = retry.RetryPolicy(backoff_max=10, max_retry_after=60)
+        error = service_error(503, {'retry-after': "30"})
+
+        self.assertEqual(policy.delay("GET", 0, error), 30)
+
+    def test_stops_retrying_when_budget_is_spent(self):
+        budget = retry.RetryBudget(ratio=0.5, min_per_second=0,
+                                   max_tokens=1)
+        policy = retry.RetryPolicy(budget=budget)
+
+        self.assertNotEqual(policy.delay("GET", 0, service_error(503)), None)
+        self.assertEqual(policy.delay("GET", 0, service_error(503)), None)
+        budget.record_request()
+        budget.record_request()
+        self.assertNotEqual(policy.delay("GET", 0, service_error(503)), None)
+
+
+class TestParseRetryAfter(tests.BaseTest):
+
+    def test_parses_seconds(self):
+        self.assertEqual(retry.parse_retry_after("120"), 120)
+
+    def test_parses_http_date_in_the_past_as_zero(self):
+        self.assertEqual(
+            retry.parse_retry_after("Fri, 31 Dec 1999 23:59:59 GMT"), 0)
+
+    def test_ignores_missing_or_invalid_values(self):
+        self.assertEqual(retry.parse_retry_after(None), None)
+        self.assertEqual(retry.parse_retry_after("soon"), None)
@@ -0,0 +1,137 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+import threading
+import time
+
+from melange_client import exception
+from melange_client import slowlog
+from melange_client import tests
+from melange_client import timing
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestSlowRequestLog(tests.BaseTest):
+
+    def setUp(self):
+        super(TestSlowRequestLog, self).setUp()
+        self.logger = logging.getLogger("melange_client.tests.slowlog")
+        self.handler = RecordingHandler()
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        super(TestSlowRequestLog, self).tearDown()
+
+    def test_logs_structured_record_for_slow_request(self):
+        slow_log = slowlog.SlowRequestLog(threshold=0, logger=self.logger)
+        response = self.mock.CreateMockAnything()
+        response.status = 200
+        response.retries = 2
+        response.timing = timing.RequestTiming("GET", "/a", "host:80")
+        response.timing.wait = 0.5
+
+        slow_log.start().finish("GET", "/a", "tenant1", response)
+
+        record = self.handler.records[0].slow_request
+        self.assertEqual(record['method'], "GET")
+        self.assertEqual(record['tenant'], "tenant1")
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['retries'], 2)
+        self.assertEqual(record['phases']['wait'], 0.5)
+        self.assertTrue("Slow request: GET /a" in
+                        self.handler.records[0].getMessage())
+
+    def test_records_error_of_failed_request(self):
+        slow_log = slowlog.SlowRequestLog(threshold=0, logger=self.logger)
+
+        record = slow_log.start().finish(
+            "DELETE", "/a", None,
+            exception.MelangeServiceResponseError("gone", 404))
+
+        self.assertEqual(record['status'], 404)
+        self.assertEqual(record['phases'], {})
+        self.assertTrue("gone" in record['error'])
+
+    def test_fast_requests_are_not_logged(self):
+        slow_log = slowlog.SlowRequestLog(threshold=60, logger=self.logger)
+
+        self.assertEqual(slow_log.start().finish("GET", "/a", None, None),
+                         None)
+        self.assertEqual(self.handler.records, [])
+
+
+class TestSamplingProfiler(tests.BaseTest):
+
+    def profiler(self, **kwargs):
+        profiler = slowlog.SamplingProfiler(**kwargs)
+        self.addCleanup(profiler.close)
+        return profiler
+
+    def test_samples_stacks_of_thread_past_its_deadline(self):
+        profiler = self.profiler()
+        thread_id = threading.current_thread().ident
+
+        profiler.watch(thread_id, time.time() - 1)
+        profiler.sample()
+        samples = profiler.unwatch(thread_id)
+
+        stack, count = samples.most_common(1)[0]
+        self.assertTrue(count >= 1)
+        self.assertTrue(stack[-1].endswith(" sample"))
+
+    def test_threads_before_their_deadline_are_not_sampled(self):
+        profiler = self.profiler(interval=60)
+        thread_id = threading.current_thread().ident
+
+        profiler.watch(thread_id, time.time() + 60)
+        profiler.sample()
+
+        self.assertEqual(profiler.unwatch(thread_id), {})
+
+    def test_sampling_thread_exits_when_nothing_is_watched(self):
+        profiler = self.profiler(interval=0.001)
+        thread_id = threading.current_thread().ident
+
+        profiler.watch(thread_id, time.time() + 60)
+        sampler = profiler._thread
+        profiler.unwatch(thread_id)
+        sampler.join(5)
+
+        self.assertFalse(sampler.is_alive())
+        self.assertEqual(profiler._thread, None)
+        profiler.watch(thread_id, time.time() + 60)
+        self.assertTrue(profiler._thread.is_alive())
+
+    def test_close_stops_sampling_thread(self):
+        profiler = self.profiler(interval=60)
+        profiler.watch(threading.current_thread().ident, time.time())
+        sampler = profiler._thread
+
+        profiler.close()
+
+        self.assertFalse(sampler.is_alive())
@@ -0,0 +1,53 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from melange_client import tests
+from melange_client import timing
+
+
+class TestRequestTiming(tests.BaseTest):
+
+    def test_total_is_sum_of_phases(self):
+        request_timing = timing.RequestTiming("GET", "/a", "localhost:8080")
+        request_timing.record_connect(dict(dns=0.01, connect=0.02))
+        request_timing.wait = 0.1
+
+        self.assertAlmostEqual(request_timing.total, 0.13)
+        self.assertFalse(request_timing.reused)
+        self.assertEqual(request_timing.as_dict()['dns'], 0.01)
+
+
+class TestTimingSummary(tests.BaseTest):
+
+    def test_report_lists_requests_and_phase_totals(self):
+        summary = timing.TimingSummary()
+        for wait in (0.1, 0.3):
+            request_timing = timing.RequestTiming("GET", "/a", "host:80")
+            request_timing.wait = wait
+            request_timing.bytes_received = 100
+            summary(request_timing)
+
+        report = summary.report()
+
+        self.assertEqual(len(report), 2 + 1 + len(timing.PHASES) + 1)
+        self.assertEqual(report[2],
+                         "2 requests, 0 bytes sent, 200 bytes received")
+        self.assertTrue(report[3 + timing.PHASES.index("wait")].startswith(
+            "wait      total=400.0ms"))
+
+    def test_report_is_empty_without_requests(self):
+        self.assertEqual(timing.TimingSummary().report(), [])
@@ -0,0 +1,103 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+from melange_client import tests
+from melange_client import timing
+from melange_client import tracing
+
+
+class TestTracer(tests.BaseTest):
+
+    def setUp(self):
+        super(TestTracer, self).setUp()
+        self.tracer = tracing.Tracer()
+
+    def test_nested_spans_share_trace_and_link_to_parent(self):
+        with self.tracer.span("ip_block.create") as parent:
+            with self.tracer.span("auth") as child:
+                pass
+
+        self.assertEqual(self.tracer.exporter.spans, [child, parent])
+        self.assertEqual(child.trace_id, parent.trace_id)
+        self.assertEqual(child.parent_id, parent.span_id)
+        self.assertEqual(parent.parent_id, None)
+        self.assertTrue(parent.end >= child.end)
+
+    def test_span_records_error_and_reraises(self):
+        def fail():
+            with self.tracer.span("http"):
+                raise ValueError("failed")
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.tracer.exporter.spans[0].attributes['error'],
+                         "ValueError('failed',)")
+        self.assertEqual(self.tracer.current_span(), None)
+
+    def test_inject_adds_traceparent_of_current_span(self):
+        headers = {}
+        self.tracer.inject(headers)
+        self.assertEqual(headers, {})
+
+        with self.tracer.span("http") as span:
+            self.tracer.inject(headers)
+
+        self.assertEqual(headers['traceparent'],
+                         "00-%s-%s-01" % (span.trace_id, span.span_id))
+        self.assertEqual(len(span.trace_id), 32)
+        self.assertEqual(len(span.span_id), 16)
+
+    def test_record_timing_adds_a_span_per_phase(self):
+        request_timing = timing.RequestTiming("GET", "/a", "localhost:80")
+        request_timing.record_connect(dict(dns=0.1, connect=0.2))
+        request_timing.wait = 0.5
+
+        with self.tracer.span("http"):
+            self.tracer.record_timing(request_timing)
+
+        spans = dict((span.name, span) for span in self.tracer.exporter.spans)
+        self.assertEqual(sorted(spans), ["connect", "http", "send",
+                                         "transfer", "wait"])
+        self.assertAlmostEqual(spans['wait'].start - spans['connect'].start,
+                               0.3)
+        self.assertAlmostEqual(spans['wait'].duration, 0.5)
+
+
+class TestJsonLinesExporter(tests.BaseTest):
+
+    def test_writes_one_json_object_per_span(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "spans.jsonl")
+        try:
+            exporter = tracing.JsonLinesExporter(path)
+            tracer = tracing.Tracer(exporter)
+            with tracer.span("ip_block.list", tenant="t1"):
+                pass
+            exporter.close()
+
+            with open(path) as spans_file:
+                spans = [json.loads(line) for line in spans_file]
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]['name'], "ip_block.list")
+        self.assertEqual(spans[0]['attributes'], {'tenant': "t1"})
@@ -35,3 +35,33 @@ class TestUtils(tests.BaseTest):
         self.assertEquals("AaBbCc", utils.camelize("aa_bb_cc"))
         self.assertEquals("Aa", utils.camelize("aa"))
         self.assertEquals("AaBbCc", utils.camelize("AaBbCc"))
+
+    def test_parse_isotime(self):
+        self.assertEquals(0, utils.parse_isotime("1970-01-01T00:00:00"))
+        self.assertEquals(0, utils.parse_isotime("1970-01-01T00:00:00Z"))
+        self.assertEquals(60, utils.parse_isotime("1970-01-01T00:01:00.000"))
+        self.assertEquals(-3600,
+                          utils.parse_isotime("1970-01-01T00:00:00+01:00"))
+
+    def test_parse_isotime_raises_error_for_invalid_timestamps(self):
+        self.assertRaises(ValueError, utils.parse_isotime, "yesterday")
+
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+
+        self.assertEquals(1, utils.percentile(values, 0))
+        self.assertEquals(3, utils.percentile(values, 50))
+        self.assertEquals(5, utils.percentile(values, 99))
+        self.assertEquals(None, utils.percentile([], 50))
+
+    def test_parse_endpoints(self):
+        self.assertEquals([("a", 9898), ("b", 80)],
+                          utils.parse_endpoints("a, b:80", 9898))
+        self.assertEquals([("a", 9898)], utils.parse_endpoints("a", "9898"))
+        self.assertEquals([("a", 1), ("b", 9898)],
+                          utils.parse_endpoints([("a", 1), "b"], 9898))
+
+    def test_parse_endpoints_with_ipv6_literals(self):
+        self.assertEquals([("::1", 80), ("fe80::1", 9898), ("::1", 9898)],
+                          utils.parse_endpoints("[::1]:80,[fe80::1],::1",
+                                                9898))
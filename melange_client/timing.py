@@ -0,0 +1,114 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Where the time of an HTTP request goes, phase by phase."""
+
+import threading
+import time
+
+from melange_client import utils
+
+PHASES = ("dns", "connect", "tls", "send", "wait", "transfer")
+
+
+class RequestTiming(object):
+    """Seconds spent in each phase of one request on the wire.
+
+    dns, connect and tls stay 0 when a pooled connection was reused. wait
+    is the time to the first byte of the response and transfer the time
+    spent reading its body. Byte counts are for the bodies as they crossed
+    the wire, before any decoding.
+
+    """
+
+    def __init__(self, method, url, endpoint):
+        self.method = method
+        self.url = url
+        self.endpoint = endpoint
+        self.started = time.time()
+        self.status = None
+        self.reused = True
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        for phase in PHASES:
+            setattr(self, phase, 0.0)
+
+    @property
+    def total(self):
+        return sum(getattr(self, phase) for phase in PHASES)
+
+    def record_connect(self, timings):
+        self.reused = False
+        for phase, seconds in timings.iteritems():
+            setattr(self, phase, seconds)
+
+    def as_dict(self):
+        result = dict((phase, getattr(self, phase)) for phase in PHASES)
+        result.update(method=self.method,
+                      url=self.url,
+                      started=self.started,
+                      endpoint=self.endpoint,
+                      status=self.status,
+                      reused=self.reused,
+                      bytes_sent=self.bytes_sent,
+                      bytes_received=self.bytes_received,
+                      total=self.total)
+        return result
+
+    def __str__(self):
+        phases = " ".join("%s=%.1fms" % (phase, getattr(self, phase) * 1000)
+                          for phase in PHASES)
+        return "%s %s %s %s total=%.1fms sent=%dB received=%dB" % (
+            self.method, self.url, self.status, phases, self.total * 1000,
+            self.bytes_sent, self.bytes_received)
+
+
+class TimingSummary(object):
+    """Collects RequestTimings; usable directly as a timing hook."""
+
+    def __init__(self):
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def __call__(self, timing):
+        with self._lock:
+            self.timings.append(timing)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.timings)
+
+    def clear(self):
+        with self._lock:
+            del self.timings[:]
+
+    def report(self):
+        """Per-request lines followed by per-phase totals and medians."""
+        timings = self.snapshot()
+        lines = [str(timing) for timing in timings]
+        if not timings:
+            return lines
+        lines.append("%d requests, %d bytes sent, %d bytes received" % (
+            len(timings),
+            sum(timing.bytes_sent for timing in timings),
+            sum(timing.bytes_received for timing in timings)))
+        for phase in PHASES + ("total",):
+            values = [getattr(timing, phase) for timing in timings]
+            lines.append("%-9s total=%.1fms p50=%.1fms max=%.1fms" % (
+                phase, sum(values) * 1000,
+                utils.percentile(values, 50) * 1000, max(values) * 1000))
+        return lines
@@ -0,0 +1,176 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tracing spans for client calls, propagated to the server in a header."""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Span(object):
+
+    def __init__(self, name, trace_id, parent_id=None, start=None,
+                 **attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.start = start or time.time()
+        self.end = None
+        self.attributes = attributes
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    def as_dict(self):
+        return dict(name=self.name,
+                    trace_id=self.trace_id,
+                    span_id=self.span_id,
+                    parent_id=self.parent_id,
+                    start=self.start,
+                    end=self.end,
+                    duration=self.duration,
+                    attributes=self.attributes)
+
+
+class Tracer(object):
+    """Creates spans and hands the finished ones to an exporter.
+
+    The current span is kept per thread; new spans become its children.
+    inject adds a W3C traceparent header for the current span, so that
+    the server can join the trace.
+
+    """
+
+    HEADER = "traceparent"
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter or InMemoryExporter()
+        self._local = threading.local()
+
+    def current_span(self):
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        span = self._new_span(name, **attributes)
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(span)
+        try:
+            yield span
+        except Exception as error:
+            span.attributes['error'] = repr(error)
+            raise
+        finally:
+            stack.pop()
+            self._finish(span)
+
+    def record(self, name, start, end, **attributes):
+        """Records an already finished child of the current span."""
+        span = self._new_span(name, start=start, **attributes)
+        span.end = end
+        self.exporter.export(span)
+        return span
+
+    def record_timing(self, request_timing):
+        """Records the wire phases of a timing.RequestTiming as spans."""
+        start = request_timing.started
+        connect = (request_timing.dns + request_timing.connect +
+                   request_timing.tls)
+        if not request_timing.reused:
+            self.record("connect", start, start + connect,
+                        dns=request_timing.dns, tls=request_timing.tls)
+        start += connect
+        for phase in ("send", "wait", "transfer"):
+            end = start + getattr(request_timing, phase)
+            self.record(phase, start, end)
+            start = end
+
+    def inject(self, headers):
+        span = self.current_span()
+        if span is not None:
+            headers[self.HEADER] = "00-%s-%s-01" % (span.trace_id,
+                                                    span.span_id)
+
+    def _new_span(self, name, start=None, **attributes):
+        parent = self.current_span()
+        if parent is None:
+            return Span(name, _random_id(16), start=start, **attributes)
+        return Span(name, parent.trace_id, parent.span_id, start,
+                    **attributes)
+
+    def _finish(self, span):
+        span.end = time.time()
+        self.exporter.export(span)
+
+
+def maybe_span(tracer, name, **attributes):
+    """tracer.span(name), or a context that does nothing without tracer."""
+    if tracer is None:
+        return _no_span()
+    return tracer.span(name, **attributes)
+
+
+@contextlib.contextmanager
+def _no_span():
+    yield None
+
+
+class InMemoryExporter(object):
+    """Keeps finished spans in a list, up to max_spans of them."""
+
+    def __init__(self, max_spans=10000):
+        self.max_spans = max_spans
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+            del self.spans[:-self.max_spans]
+
+    def clear(self):
+        with self._lock:
+            del self.spans[:]
+
+
+class JsonLinesExporter(object):
+    """Appends every finished span to a file as one line of JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.as_dict())
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _random_id(size):
+    return os.urandom(size).encode("hex")
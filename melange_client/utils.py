@@ -15,9 +15,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import calendar
+import math
 import re
 import os
-import subprocess
+import time
 
 import melange_client
 
@@ -31,6 +33,60 @@ def remove_nones(hash):
                for key, value in hash.iteritems() if value is not None)
 
 
+def parse_endpoints(hosts, default_port):
+    """Turns "host1,host2:port" or a list of hosts into (host, port) pairs.
+
+    Hosts may be given as "host", "host:port" or (host, port) tuples. IPv6
+    literals need brackets to carry a port, as in "[::1]:9898".
+
+    """
+    if isinstance(hosts, basestring):
+        hosts = [host.strip() for host in hosts.split(",") if host.strip()]
+    endpoints = []
+    for host in hosts:
+        if isinstance(host, tuple):
+            endpoints.append((host[0], int(host[1])))
+        elif host.startswith("["):
+            host, _bracket, port = host[1:].partition("]")
+            endpoints.append((host, int(port.lstrip(":") or default_port)))
+        elif host.count(":") == 1:
+            host, port = host.rsplit(":", 1)
+            endpoints.append((host, int(port)))
+        else:
+            endpoints.append((host, int(default_port)))
+    return endpoints
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of values; None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def parse_isotime(timestr):
+    """Converts an ISO 8601 timestamp to seconds since the epoch.
+
+    Timestamps without a timezone designator are taken to be in UTC, which
+    is what keystone returns for token expiry.
+
+    """
+    match = re.match(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(\.\d+)?"
+                     r"(Z|[+-]\d{2}:?\d{2})?$", timestr.strip())
+    if not match:
+        raise ValueError("Invalid ISO 8601 timestamp %s" % timestr)
+    seconds = calendar.timegm(time.strptime(match.group(1),
+                                            "%Y-%m-%dT%H:%M:%S"))
+    offset = match.group(3)
+    if offset and offset != "Z":
+        sign = -1 if offset[0] == "-" else 1
+        digits = offset[1:].replace(":", "")
+        seconds -= sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+    return seconds
+
+
 def execute(cmd, raise_error=True):
     """Executes a command in a subprocess.
     Returns a tuple of (exitcode, out, err), where out is the string output
@@ -42,6 +98,7 @@ def execute(cmd, raise_error=True):
                         raise a RuntimeError? Default: True)
 
     """
+    import subprocess
 
     env = os.environ.copy()
 
@@ -0,0 +1,154 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures how quickly bin/melange starts.
+
+Reports the time taken to import the modules every command needs, and the
+time from starting `melange ip_block list` until its request reaches a
+local stand-in for the Melange API. Exits with status 1 when the median
+time to first request is over the target, so it can gate a release.
+
+    python tools/startup_benchmark.py [--runs N] [--target-ms MS] [--json]
+"""
+
+import BaseHTTPServer
+import json
+import optparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+MELANGE = os.path.join(ROOT, 'bin', 'melange')
+
+# Modules that simple commands should not have to load.
+LAZY_MODULES = ('yaml', 'httplib2', 'melange_client.template', 'inspect')
+
+IMPORT_SCRIPT = """
+import sys, time
+started = time.time()
+import melange_client.inspector, melange_client.ipam_client
+print time.time() - started
+print ",".join(m for m in %r if m in sys.modules)
+""" % (LAZY_MODULES,)
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    arrivals = []
+
+    def do_GET(self):
+        self.arrivals.append(time.time())
+        body = json.dumps({'ip_blocks': []})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def python_env():
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [ROOT, env.get('PYTHONPATH')]))
+    return env
+
+
+def measure_imports(runs):
+    times = []
+    for _i in range(runs):
+        out = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT],
+                                      env=python_env())
+        seconds, loaded = out.splitlines()
+        times.append(float(seconds))
+    return times, [module for module in loaded.split(",") if module]
+
+
+def measure_first_request(runs):
+    server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    command = [sys.executable, MELANGE, "-H", "127.0.0.1",
+               "-p", str(server.server_address[1]), "-t", "tenant",
+               "--no-token-cache", "ip_block", "list"]
+
+    first_request, total = [], []
+    try:
+        for _i in range(runs):
+            del StandInHandler.arrivals[:]
+            started = time.time()
+            with open(os.devnull, "w") as devnull:
+                subprocess.check_call(command, stdout=devnull,
+                                      env=python_env())
+            total.append(time.time() - started)
+            first_request.append(StandInHandler.arrivals[0] - started)
+    finally:
+        server.shutdown()
+    return first_request, total
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type=int, default=10,
+                      help="Runs of each measurement. Default: %default")
+    parser.add_option('--target-ms', type=float, default=100,
+                      help="Time to first request to stay under. "
+                           "Default: %default")
+    parser.add_option('--json', action="store_true", default=False,
+                      help="Print the results as one line of JSON, for "
+                           "tracking them across releases")
+    options, _args = parser.parse_args()
+
+    import_times, eager = measure_imports(options.runs)
+    first_request, total = measure_first_request(options.runs)
+    results = dict(import_ms=median(import_times) * 1000,
+                   first_request_ms=median(first_request) * 1000,
+                   total_ms=median(total) * 1000,
+                   eagerly_loaded=eager,
+                   target_ms=options.target_ms)
+
+    if options.json:
+        print json.dumps(results, sort_keys=True)
+    else:
+        print "import:        %(import_ms)6.1f ms" % results
+        print "first request: %(first_request_ms)6.1f ms" % results
+        print "total:         %(total_ms)6.1f ms" % results
+        if eager:
+            print "eagerly loaded: %s" % ", ".join(eager)
+
+    if results['first_request_ms'] > options.target_ms:
+        print >> sys.stderr, ("time to first request is over the %d ms "
+                              "target" % options.target_ms)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()